@@ -1,54 +1,429 @@
+import time
+
+MODULE_IMPORT_STARTED = time.perf_counter()
+
 import os
+import sys
 import json
-import time
+import asyncio
+import threading
 from http.server import BaseHTTPRequestHandler
-from groq import Groq
 from nacl.signing import VerifyKey
 from nacl.exceptions import BadSignatureError
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smartie.tokens import token_counter, usage_from_chunk
+from smartie.prompts import PromptBuilder, select_variant
+from smartie.history import HistoryStore, HISTORY_TTL_SECONDS
+from smartie.backends import create_backend
+from smartie.clients import get_async_groq_client, get_http_client, run_in_background_loop
+from smartie.render import StreamingEditor, EditRateLimited
+from smartie.cache import ResponseCache
+from smartie.scheduler import Scheduler
+from smartie.generations import GenerationRegistry
+from smartie.summary import Summarizer
+from smartie.router import ModelRouter
+from smartie.singleflight import SingleFlight, flight_key
+from smartie.zhconvert import traditional_stream
+from smartie.pagination import split_pages, preview_page, page_footer, display_limit, RESPONSE_PAGE_CHARS
+from smartie.metrics import metrics, METRICS_TOKEN
+from smartie.server import BackgroundTasks, serve
+
 DISCORD_PUBLIC_KEY = os.getenv('DISCORD_PUBLIC_KEY')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_APPLICATION_ID = os.getenv('DISCORD_APPLICATION_ID')
 
-conversation_history = {}
+TIMING_REPORT_ENABLED = os.getenv('WEBHOOK_TIMING_REPORT', '1') != '0'
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'sqlite')
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', '/tmp/smartie_history.sqlite3')
+GENERATION_TIMEOUT_SECONDS = 60.0
+
+DISCORD_API_BASE = 'https://discord.com/api/v10'
+DISCORD_USER_AGENT = 'DiscordBot (https://github.com/Kevin42127/Smartie, 1.0)'
+
+PING_ACK_BODY = json.dumps({'type': 1}).encode()
+DEFERRED_ACK_BODY = json.dumps({'type': 5}).encode()
+EMPTY_MESSAGE_BODY = json.dumps({'type': 4, 'data': {'content': '請輸入有效的訊息內容'}}).encode()
+MESSAGE_TOO_LONG_BODY = json.dumps({'type': 4, 'data': {'content': '訊息長度不能超過 2000 字元'}}).encode()
+MISSING_API_KEY_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'embeds': [{
+            'color': 0xFF0000,
+            'author': {'name': '小智'},
+            'description': '🔐 API key 未設定，請檢查環境變數'
+        }]
+    }
+}).encode()
+MISSING_PUBLIC_KEY_BODY = json.dumps({'error': 'DISCORD_PUBLIC_KEY not configured'}).encode()
+INVALID_SIGNATURE_BODY = json.dumps({'error': 'Invalid signature'}).encode()
+INVALID_JSON_BODY = json.dumps({'error': 'Invalid JSON'}).encode()
+UNAUTHORIZED_BODY = json.dumps({'error': 'Unauthorized'}).encode()
+UNKNOWN_COMMAND_BODY = json.dumps({'error': 'Unknown command'}).encode()
+UNKNOWN_INTERACTION_BODY = json.dumps({'error': 'Unknown interaction type'}).encode()
+METHOD_NOT_ALLOWED_BODY = json.dumps({'error': 'Method not allowed'}).encode()
+MEMORY_CLEARED_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'embeds': [{
+            'color': 0x00FF00,
+            'author': {'name': '小智'},
+            'description': '✅ 已清除對話記憶'
+        }]
+    }
+}).encode()
+GENERATION_STOPPED_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'flags': 64,
+        'embeds': [{
+            'color': 0x00FF00,
+            'author': {'name': '小智'},
+            'description': '🛑 已停止生成回應'
+        }]
+    }
+}).encode()
+NO_GENERATION_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'flags': 64,
+        'embeds': [{
+            'color': 0x5865F2,
+            'author': {'name': '小智'},
+            'description': 'ℹ️ 目前沒有正在生成的回應'
+        }]
+    }
+}).encode()
+SERVER_BUSY_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'flags': 64,
+        'embeds': [{
+            'color': 0xFFA500,
+            'author': {'name': '小智'},
+            'description': '⏳ 目前使用人數較多，請稍後再試'
+        }]
+    }
+}).encode()
+NO_MEMORY_BODY = json.dumps({
+    'type': 4,
+    'data': {
+        'embeds': [{
+            'color': 0x5865F2,
+            'author': {'name': '小智'},
+            'description': 'ℹ️ 你還沒有對話記錄'
+        }]
+    }
+}).encode()
+
+def load_verify_key(public_key_hex: str):
+    if not public_key_hex:
+        return None
+    try:
+        return VerifyKey(bytes.fromhex(public_key_hex))
+    except (ValueError, TypeError) as e:
+        print(f"Invalid DISCORD_PUBLIC_KEY: {e}")
+        return None
+
+DISCORD_VERIFY_KEY = load_verify_key(DISCORD_PUBLIC_KEY)
+
+class PhaseTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.first_byte = None
+    
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, (now - self.last) * 1000))
+        self.last = now
+    
+    def report(self, label: str, cold_start: bool = False):
+        if not TIMING_REPORT_ENABLED:
+            return
+        parts = [f"{name}={elapsed:.1f}ms" for name, elapsed in self.phases]
+        parts.append(f"total={(self.last - self.started) * 1000:.1f}ms")
+        if cold_start:
+            parts.append(f"import={(MODULE_IMPORTED - MODULE_IMPORT_STARTED) * 1000:.1f}ms")
+            if self.first_byte is not None:
+                parts.append(f"import_to_first_byte={(self.first_byte - MODULE_IMPORT_STARTED) * 1000:.1f}ms")
+        print(f"[timing] {label} {'cold ' if cold_start else ''}{' '.join(parts)}")
+
+_cold_start = True
+_cold_start_lock = threading.Lock()
+
+def take_cold_start():
+    global _cold_start
+    with _cold_start_lock:
+        cold_start = _cold_start
+        _cold_start = False
+    return cold_start
 
 MAX_HISTORY_LENGTH = 10
 MAX_HISTORY_TOKENS = 2000
 
+
+history_store = HistoryStore(
+    MAX_HISTORY_LENGTH,
+    MAX_HISTORY_TOKENS,
+    backend=create_backend(HISTORY_BACKEND, HISTORY_DB_PATH, ttl_seconds=HISTORY_TTL_SECONDS)
+)
+response_cache = ResponseCache()
+scheduler = Scheduler()
+generations = GenerationRegistry()
+router = ModelRouter()
+single_flight = SingleFlight()
+summarizer = Summarizer(history_store, GROQ_API_KEY)
+prompt_builder = PromptBuilder(history_store)
+
+metrics.register_stats('history', history_store.stats)
+metrics.register_stats('response_cache', response_cache.stats)
+metrics.register_stats('scheduler', scheduler.stats)
+metrics.register_stats('single_flight', single_flight.stats)
+metrics.register_stats('router', router.stats, label='model')
+
+# Set by serve(): the self-hosted server runs generations detached instead of
+# holding the request open like the serverless runtime requires.
+background_tasks = None
+
 def get_conversation_history(user_id: str):
-    if user_id not in conversation_history:
-        conversation_history[user_id] = []
-    return conversation_history[user_id]
+    return history_store.entries(user_id)
 
 def add_to_history(user_id: str, role: str, content: str):
-    history = get_conversation_history(user_id)
-    history.append({"role": role, "content": content})
+    return history_store.append(user_id, role, content)
+
+async def edit_original_response(application_id: str, interaction_token: str, payload: dict):
+    import httpx
     
-    total_tokens = sum(len(msg["content"]) // 3 for msg in history)
+    url = f"{DISCORD_API_BASE}/webhooks/{application_id}/{interaction_token}/messages/@original"
+    try:
+        response = await get_http_client().patch(
+            url,
+            json=payload,
+            headers={'User-Agent': DISCORD_USER_AGENT}
+        )
+    except httpx.HTTPError as e:
+        print(f"Failed to edit interaction response: {e}")
+        return None
+    if response.status_code >= 400 and response.status_code != 429:
+        print(f"Failed to edit interaction response: HTTP {response.status_code}")
+    return response
+
+async def send_followup_message(application_id: str, interaction_token: str, payload: dict):
+    import httpx
     
-    while len(history) > MAX_HISTORY_LENGTH or total_tokens > MAX_HISTORY_TOKENS:
-        removed = history.pop(0)
-        total_tokens -= len(removed["content"]) // 3
+    url = f"{DISCORD_API_BASE}/webhooks/{application_id}/{interaction_token}"
+    try:
+        response = await get_http_client().post(
+            url,
+            json=payload,
+            headers={'User-Agent': DISCORD_USER_AGENT}
+        )
+    except httpx.HTTPError as e:
+        print(f"Failed to send follow-up message: {e}")
+        return None
+    if response.status_code >= 400:
+        print(f"Failed to send follow-up message: HTTP {response.status_code}")
+    return response
+
+def build_embed(description: str, footer_text: str = None, color: int = 0x5865F2):
+    embed = {
+        "description": description,
+        "color": color,
+        "author": {
+            "name": "小智"
+        }
+    }
+    if footer_text:
+        embed["footer"] = {"text": footer_text}
+    return embed
+
+def response_footer(start_time: float, cached: bool = False):
+    elapsed_time = time.time() - start_time
+    response_time_text = f"⏱️ 回應時間: {elapsed_time:.2f} 秒"
+    if cached:
+        response_time_text += " · ⚡ 快取"
+    return response_time_text
+
+def build_response_embed(response_text: str, start_time: float, cached: bool = False):
+    return build_embed(response_text, response_footer(start_time, cached))
 
-def build_messages(system_prompt: str, user_message: str, user_id: str):
-    history = get_conversation_history(user_id)
-    messages = [{"role": "system", "content": system_prompt}]
+async def process_xiaozhi(application_id: str, interaction_token: str, user_id: str, guild_id: str, message: str, start_time: float, cache_key: str):
+    request_metrics = metrics.request('小智')
+    outcome = 'ok'
+    evicted = []
+    conversation_id = None
     
-    for msg in history:
-        messages.append(msg)
+    async def edit_response(payload: dict):
+        edit_started = time.perf_counter()
+        response = await edit_original_response(application_id, interaction_token, payload)
+        request_metrics.edited(time.perf_counter() - edit_started)
+        return response
     
-    messages.append({"role": "user", "content": user_message})
-    return messages
+    async def send_pages(pages: list, footer_text: str):
+        # The original message shows the first page; the rest follow as
+        # follow-up messages, since webhook interactions cannot hold a view.
+        await edit_response({
+            'content': '',
+            'embeds': [build_embed(pages[0], page_footer(footer_text, 0, len(pages)))]
+        })
+        for index in range(1, len(pages)):
+            await send_followup_message(application_id, interaction_token, {
+                'embeds': [build_embed(pages[index], page_footer(footer_text, index, len(pages)))]
+            })
+    
+    try:
+        variant = select_variant(message)
+        messages, prompt_tokens, max_tokens_value = prompt_builder.prepare(variant, message, user_id)
+        request_metrics.prompt(prompt_tokens, history_store.tokens(user_id))
+        
+        generation_started = False
+        
+        async def show_queue_position(position: int):
+            if not generation_started:
+                await edit_response({
+                    'content': f"⏳ 目前排隊中，你排在第 {position} 位，請稍候..."
+                })
+        
+        async def edit_preview(text: str):
+            preview_text, page_count = preview_page(text)
+            response = await edit_response({
+                'content': '',
+                'embeds': [build_embed(preview_text, page_footer("⏳ 正在生成回應...", page_count - 1, page_count))]
+            })
+            if response is None:
+                raise RuntimeError("interaction edit failed")
+            if response.status_code == 429:
+                raise EditRateLimited(float(response.headers.get('retry-after', 1)))
+            return response.headers
+        
+        async def stream_response(editor: StreamingEditor):
+            candidates = router.candidates(message, max_tokens_value)
+            shareable = len(messages) == 2
+            stream = single_flight.subscribe(
+                flight_key(candidates[0], variant.content, message, max_tokens_value) if shareable else None,
+                lambda: router.open_stream(
+                    scheduler,
+                    lambda model: get_async_groq_client(GROQ_API_KEY).chat.completions.with_raw_response.create(
+                        messages=messages,
+                        model=model,
+                        temperature=0.7,
+                        max_tokens=max_tokens_value,
+                        stream=True
+                    ),
+                    candidates,
+                    prompt_tokens
+                )
+            )
+            
+            conversion = traditional_stream()
+            try:
+                async for chunk in stream:
+                    if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                        request_metrics.token()
+                        editor.push(conversion.feed(chunk.choices[0].delta.content))
+                        if editor.full:
+                            break
+                    
+                    usage = usage_from_chunk(chunk)
+                    if usage is not None:
+                        request_metrics.completed_tokens(usage.completion_tokens)
+                        if stream.leader:
+                            token_counter.calibrate(prompt_tokens, usage.prompt_tokens)
+                            token_counter.observe_output(editor.buffer.length, usage.completion_tokens)
+                            scheduler.charge_tokens(usage.completion_tokens)
+            finally:
+                editor.push(conversion.flush())
+                request_metrics.model = stream.model
+                await stream.close()
+        
+        response_text = ""
+        
+        async def run_generation():
+            nonlocal generation_started, response_text
+            async with scheduler.slot(user_id, guild_id, on_position=show_queue_position):
+                generation_started = True
+                request_metrics.queued()
+                editor = StreamingEditor(edit_preview, max_chars=display_limit()).start()
+                try:
+                    await asyncio.wait_for(stream_response(editor), timeout=GENERATION_TIMEOUT_SECONDS)
+                except BaseException:
+                    response_text = editor.cancel()
+                    raise
+                response_text = await editor.close()
+        
+        generation = generations.start(user_id, run_generation())
+        try:
+            await generation.task
+        except asyncio.CancelledError:
+            if not generation.stopped:
+                raise
+            outcome = 'stopped'
+            await send_pages(split_pages(response_text or "🛑 已停止生成回應"), f"🛑 已停止生成 · ⏱️ {time.time() - start_time:.2f} 秒")
+            return
+        
+        if len(response_text) <= RESPONSE_PAGE_CHARS:
+            response_cache.put(cache_key, response_text)
+        evicted = add_to_history(user_id, "user", message)
+        evicted += add_to_history(user_id, "assistant", response_text)
+        conversation_id = history_store.conversation_id(user_id)
+        
+        await send_pages(split_pages(response_text), response_footer(start_time))
+        
+    except asyncio.TimeoutError as e:
+        outcome = 'timeout'
+        request_metrics.error(e)
+        await edit_response({
+            'content': '',
+            'embeds': [build_embed("⏰ 抱歉，處理時間過長，請稍後再試", color=0xFF0000)]
+        })
+    except Exception as e:
+        outcome = 'error'
+        request_metrics.error(e)
+        error_msg = str(e)
+        print(f"Groq API error: {error_msg}")
+        
+        error_lower = error_msg.lower()
+        if "api_key" in error_lower or "authentication" in error_lower:
+            description = "🔐 API 驗證失敗，請檢查 API key 設定"
+        elif "rate_limit" in error_lower or "quota" in error_lower:
+            description = "⚠️ API 使用量已達上限，請稍後再試"
+        elif "context_length" in error_lower or "token" in error_lower or "length" in error_lower or "too long" in error_lower:
+            description = "📝 訊息太長了！請將訊息縮短或分段發送。建議長度約為 1500 字元以內。"
+        else:
+            description = "❌ 發生錯誤，請稍後再試"
+        
+        await edit_response({
+            'content': '',
+            'embeds': [build_embed(description, color=0xFF0000)]
+        })
+    finally:
+        request_metrics.finish(outcome)
+    
+    # Compacted after finish() so completion time covers only what the user waits for.
+    await summarizer.compact(user_id, evicted, conversation_id)
+
+def run_detached(coro):
+    if background_tasks is None:
+        return run_in_background_loop(coro)
+    background_tasks.spawn(coro)
+
+async def stop_generations(user_id: str):
+    return generations.stop(user_id)
+
+def get_user_id(data: dict):
+    return str(data.get('member', {}).get('user', {}).get('id', '') or data.get('user', {}).get('id', ''))
 
 def verify_signature(raw_body, signature, timestamp):
     try:
-        if not DISCORD_PUBLIC_KEY:
+        if DISCORD_VERIFY_KEY is None:
             print("DISCORD_PUBLIC_KEY not configured")
             return False
         message = timestamp.encode() + raw_body
-        verify_key = VerifyKey(bytes.fromhex(DISCORD_PUBLIC_KEY))
-        verify_key.verify(message, bytes.fromhex(signature))
+        DISCORD_VERIFY_KEY.verify(message, bytes.fromhex(signature))
         return True
     except (BadSignatureError, ValueError, TypeError) as e:
         print(f"Signature verification error: {e}")
@@ -58,203 +433,144 @@ def verify_signature(raw_body, signature, timestamp):
         return False
 
 class Handler(BaseHTTPRequestHandler):
+    timer = None
+    
+    def send_json(self, status_code: int, payload: dict):
+        self.send_body(status_code, json.dumps(payload).encode())
+    
+    def send_body(self, status_code: int, body: bytes):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+        if self.timer is not None and self.timer.first_byte is None:
+            self.timer.first_byte = time.perf_counter()
+            self.timer.mark('respond')
+    
     def do_POST(self):
+        self.timer = PhaseTimer()
+        cold_start = take_cold_start()
+        label = 'unknown'
         try:
             signature = self.headers.get('x-signature-ed25519', '') or self.headers.get('X-Signature-Ed25519', '')
             timestamp = self.headers.get('x-signature-timestamp', '') or self.headers.get('X-Signature-Timestamp', '')
             
             content_length = int(self.headers.get('Content-Length', 0))
             raw_body = self.rfile.read(content_length)
+            self.timer.mark('read')
             
-            if not DISCORD_PUBLIC_KEY:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'DISCORD_PUBLIC_KEY not configured'}).encode())
+            if DISCORD_VERIFY_KEY is None:
+                self.send_body(500, MISSING_PUBLIC_KEY_BODY)
                 return
             
             if not verify_signature(raw_body, signature, timestamp):
-                self.send_response(401)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Invalid signature'}).encode())
+                self.send_body(401, INVALID_SIGNATURE_BODY)
                 return
+            self.timer.mark('verify')
             
             try:
                 data = json.loads(raw_body.decode('utf-8'))
             except (json.JSONDecodeError, UnicodeDecodeError) as e:
                 print(f"JSON decode error: {e}")
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
+                self.send_body(400, INVALID_JSON_BODY)
                 return
+            self.timer.mark('parse')
             
             if data.get('type') == 1:
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'type': 1}).encode())
+                label = 'ping'
+                self.send_body(200, PING_ACK_BODY)
                 return
             
             if data.get('type') == 2:
                 command_name = data.get('data', {}).get('name', '')
+                label = f"command:{command_name}"
                 if command_name == '小智':
                     options = data.get('data', {}).get('options', [])
                     if not options:
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'type': 4,
-                            'data': {
-                                'content': '請輸入有效的訊息內容'
-                            }
-                        }).encode())
+                        self.send_body(200, EMPTY_MESSAGE_BODY)
                         return
                     
                     message = options[0].get('value', '')
                     
                     if not message or len(message.strip()) == 0:
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'type': 4,
-                            'data': {
-                                'content': '請輸入有效的訊息內容'
-                            }
-                        }).encode())
+                        self.send_body(200, EMPTY_MESSAGE_BODY)
                         return
                     
                     if len(message) > 2000:
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'type': 4,
-                            'data': {
-                                'content': '訊息長度不能超過 2000 字元'
-                            }
-                        }).encode())
+                        self.send_body(200, MESSAGE_TOO_LONG_BODY)
                         return
                     
                     if not GROQ_API_KEY:
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'type': 4,
-                            'data': {
-                                'embeds': [{
-                                    'color': 0xFF0000,
-                                    'author': {'name': '小智'},
-                                    'description': '🔐 API key 未設定，請檢查環境變數'
-                                }]
-                            }
-                        }).encode())
+                        self.send_body(200, MISSING_API_KEY_BODY)
                         return
                     
                     start_time = time.time()
-                    message_length = len(message)
-                    user_id = str(data.get('member', {}).get('user', {}).get('id', '') or data.get('user', {}).get('id', ''))
+                    user_id = get_user_id(data)
+                    application_id = data.get('application_id') or DISCORD_APPLICATION_ID
+                    interaction_token = data.get('token', '')
                     
-                    try:
-                        history = get_conversation_history(user_id)
-                        history_tokens = sum(len(msg["content"]) // 3 for msg in history)
-                        estimated_tokens = message_length // 3
-                        available_tokens = 4096 - history_tokens - estimated_tokens - 200
-                        max_tokens_value = max(512, min(2048, available_tokens))
-                        
-                        if message_length > 1500:
-                            system_prompt = "你是一個友善、自然的 AI 助手，由 Groq AI 提供技術支援。你的名字是小智，專門在 Discord 伺服器中幫助用戶回答問題和進行對話。\n\n重要：你必須且只能使用繁體中文回應，絕對不能使用簡體中文。所有回應都必須使用繁體中文字體，包括標點符號。如果遇到簡體中文輸入，請在回應時轉換為繁體中文。\n\n請用繁體中文以自然、口語化的方式回應，就像和朋友聊天一樣。避免使用過於正式或生硬的語氣，讓對話更流暢自然。當被問到你是誰、你的身分或相關問題時，請自然地介紹自己是小智。\n\n注意：用戶的訊息較長，請簡潔地回應重點。"
-                        else:
-                            system_prompt = "你是一個友善、自然的 AI 助手，由 Groq AI 提供技術支援。你的名字是小智，專門在 Discord 伺服器中幫助用戶回答問題和進行對話。\n\n重要：你必須且只能使用繁體中文回應，絕對不能使用簡體中文。所有回應都必須使用繁體中文字體，包括標點符號。如果遇到簡體中文輸入，請在回應時轉換為繁體中文。\n\n請用繁體中文以自然、口語化的方式回應，就像和朋友聊天一樣。避免使用過於正式或生硬的語氣，讓對話更流暢自然。當被問到你是誰、你的身分或相關問題時，請自然地介紹自己是小智。"
-                        
-                        messages = build_messages(system_prompt, message, user_id)
-                        
-                        groq_client = Groq(api_key=GROQ_API_KEY)
-                        chat_completion = groq_client.chat.completions.create(
-                            messages=messages,
-                            model="llama-3.3-70b-versatile",
-                            temperature=0.7,
-                            max_tokens=max_tokens_value
-                        )
-                        
-                        response_text = chat_completion.choices[0].message.content
-                        
-                        add_to_history(user_id, "user", message)
-                        add_to_history(user_id, "assistant", response_text)
-                        
-                        if len(response_text) > 2000:
-                            response_text = response_text[:1997] + "..."
-                        
-                        elapsed_time = time.time() - start_time
-                        response_time_text = f"⏱️ 回應時間: {elapsed_time:.2f} 秒"
-                        
-                        embed = {
-                            "description": response_text,
-                            "color": 0x5865F2,
-                            "footer": {
-                                "text": response_time_text
-                            },
-                            "author": {
-                                "name": "小智"
-                            }
-                        }
-                        
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
+                    cache_key = response_cache.make_key(message, select_variant(message).name, get_conversation_history(user_id))
+                    cached_text = response_cache.get(cache_key)
+                    if cached_text is not None:
+                        request_metrics = metrics.request('小智')
+                        request_metrics.model = 'cache'
+                        self.send_json(200, {
                             'type': 4,
                             'data': {
-                                'embeds': [embed]
+                                'embeds': [build_response_embed(cached_text, start_time, cached=True)]
                             }
-                        }).encode())
+                        })
+                        request_metrics.finish('cached')
+                        evicted = add_to_history(user_id, "user", message)
+                        evicted += add_to_history(user_id, "assistant", cached_text)
+                        if evicted:
+                            run_detached(summarizer.compact(user_id, evicted, history_store.conversation_id(user_id)))
+                        history_store.flush()
                         return
-                        
-                    except Exception as e:
-                        error_msg = str(e)
-                        print(f"Groq API error: {error_msg}")
-                        embed = {
-                            "color": 0xFF0000,
-                            "author": {
-                                "name": "小智"
-                            }
-                        }
-                        
-                        error_lower = error_msg.lower()
-                        if "api_key" in error_lower or "authentication" in error_lower:
-                            embed["description"] = "🔐 API 驗證失敗，請檢查 API key 設定"
-                        elif "rate_limit" in error_lower or "quota" in error_lower:
-                            embed["description"] = "⚠️ API 使用量已達上限，請稍後再試"
-                        elif "context_length" in error_lower or "token" in error_lower or "length" in error_lower or "too long" in error_lower:
-                            embed["description"] = "📝 訊息太長了！請將訊息縮短或分段發送。建議長度約為 1500 字元以內。"
-                        else:
-                            embed["description"] = "❌ 發生錯誤，請稍後再試"
-                        
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'type': 4,
-                            'data': {
-                                'embeds': [embed]
-                            }
-                        }).encode())
+                    
+                    generation = process_xiaozhi(application_id, interaction_token, user_id, data.get('guild_id'), message, start_time, cache_key)
+                    if background_tasks is None:
+                        self.send_body(200, DEFERRED_ACK_BODY)
+                        run_in_background_loop(generation)
+                    elif background_tasks.reserve():
+                        try:
+                            self.send_body(200, DEFERRED_ACK_BODY)
+                        except BaseException:
+                            background_tasks.release()
+                            generation.close()
+                            raise
+                        background_tasks.spawn(generation, reserved=True)
+                    else:
+                        generation.close()
+                        request_metrics = metrics.request('小智')
+                        self.send_body(200, SERVER_BUSY_BODY)
+                        request_metrics.finish('busy')
                         return
+                    history_store.flush()
+                    self.timer.mark('followup')
+                    return
+                
+                if command_name == '停止':
+                    if run_in_background_loop(stop_generations(get_user_id(data))):
+                        self.send_body(200, GENERATION_STOPPED_BODY)
+                    else:
+                        self.send_body(200, NO_GENERATION_BODY)
+                    return
+                
+                if command_name == '清除記憶':
+                    if history_store.clear(get_user_id(data)):
+                        history_store.flush()
+                        self.send_body(200, MEMORY_CLEARED_BODY)
+                    else:
+                        self.send_body(200, NO_MEMORY_BODY)
+                    return
                 
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Unknown command'}).encode())
+                self.send_body(400, UNKNOWN_COMMAND_BODY)
                 return
             
-            self.send_response(400)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Unknown interaction type'}).encode())
+            self.send_body(400, UNKNOWN_INTERACTION_BODY)
             
         except Exception as e:
             error_msg = str(e)
@@ -262,18 +578,40 @@ class Handler(BaseHTTPRequestHandler):
             import traceback
             print(traceback.format_exc())
             try:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Internal server error'}).encode())
+                self.send_json(500, {'error': 'Internal server error'})
             except:
                 pass
+        finally:
+            self.timer.report(label, cold_start)
+            command = label.split(':', 1)[-1]
+            for name, elapsed in self.timer.phases:
+                metrics.observe('webhook_phase_seconds', elapsed / 1000, command=command, phase=name)
+                if name == 'verify':
+                    metrics.observe('signature_verify_seconds', elapsed / 1000, command=command)
     
     def do_GET(self):
-        self.send_response(405)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'error': 'Method not allowed'}).encode())
+        if METRICS_TOKEN and 'metrics' in self.path:
+            if self.headers.get('Authorization', '') != f"Bearer {METRICS_TOKEN}":
+                self.send_body(401, UNAUTHORIZED_BODY)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_body(405, METHOD_NOT_ALLOWED_BODY)
     
     def log_message(self, format, *args):
         pass
+
+def serve_forever():
+    global background_tasks
+    background_tasks = BackgroundTasks()
+    serve(Handler, background_tasks, on_shutdown=history_store.flush)
+
+MODULE_IMPORTED = time.perf_counter()
+
+if __name__ == '__main__':
+    serve_forever()
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FINAL_MARKERS = ('回應時間', '已停止生成')
+
+class InteractionTrace:
+    __slots__ = ('started', 'first_content', 'finished', 'edits', 'final_text', 'error')
+
+    def __init__(self, started: float):
+        self.started = started
+        self.first_content = None
+        self.finished = None
+        self.edits = 0
+        self.final_text = None
+        self.error = None
+
+    def observe(self, description: str, footer: str, color: int = None, now: float = None):
+        now = now if now is not None else time.perf_counter()
+        self.edits += 1
+        if description and self.first_content is None:
+            self.first_content = now
+        if footer and any(marker in footer for marker in FINAL_MARKERS):
+            self.finished = now
+            self.final_text = description
+        elif color == 0xFF0000:
+            self.finished = now
+            self.error = description
+
+class TraceBook:
+    def __init__(self):
+        self.traces = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def start(self, key: str):
+        with self._lock:
+            trace = self.traces[key] = InteractionTrace(time.perf_counter())
+            return trace
+
+    def observe(self, key: str, description: str, footer: str, color: int = None):
+        with self._lock:
+            trace = self.traces.get(key)
+            if trace is None:
+                return
+            trace.observe(description, footer, color)
+            if trace.finished is not None:
+                self._done.notify_all()
+
+    def wait(self, key: str, timeout: float):
+        with self._lock:
+            return self._done.wait_for(lambda: self.traces[key].finished is not None, timeout)
+
+class FakeDiscordHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PATCH(self):
+        parts = self.path.strip('/').split('/')
+        self._record(parts[-3] if len(parts) >= 3 else '')
+
+    def do_POST(self):
+        # Follow-up messages carry the later pages of a long answer.
+        parts = self.path.strip('/').split('/')
+        self._record(parts[-1] if parts else '')
+
+    def _record(self, token: str):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        embed = (payload.get('embeds') or [{}])[0]
+        time.sleep(self.server.edit_latency)
+        self.server.book.observe(token, embed.get('description'), (embed.get('footer') or {}).get('text'), embed.get('color'))
+
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-ratelimit-remaining', '4')
+        self.send_header('x-ratelimit-reset-after', str(self.server.reset_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_discord(book: TraceBook, edit_latency: float = 0.05, reset_after: float = 1.0, host: str = '127.0.0.1', port: int = 0):
+    server = ThreadingHTTPServer((host, port), FakeDiscordHandler)
+    server.daemon_threads = True
+    server.book = book
+    server.edit_latency = edit_latency
+    server.reset_after = reset_after
+    threading.Thread(target=server.serve_forever, name='fake-discord', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.avatar = None
+
+class FakeMessage:
+    def __init__(self, channel, trace: InteractionTrace):
+        self.channel = channel
+        self.trace = trace
+
+    async def edit(self, content=None, embed=None, view=None):
+        await self.channel.record(self.trace, content, embed)
+        return self
+
+class FakeChannel:
+    def __init__(self, edit_latency: float = 0.05):
+        self.edit_latency = edit_latency
+
+    async def record(self, trace: InteractionTrace, content=None, embed=None):
+        await asyncio.sleep(self.edit_latency)
+        if embed is not None:
+            trace.observe(embed.description, embed.footer.text if embed.footer else None, embed.color.value if embed.color else None)
+        else:
+            trace.edits += 1
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, thinking: bool = False, ephemeral: bool = False):
+        await asyncio.sleep(self.interaction.channel.edit_latency)
+
+    async def send_message(self, content=None, embed=None, ephemeral: bool = False):
+        await self.interaction.channel.record(self.interaction.trace, content, embed)
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, embed=None, ephemeral: bool = False, wait: bool = True, view=None):
+        await self.interaction.channel.record(self.interaction.trace, content, embed)
+        return FakeMessage(self.interaction.channel, self.interaction.trace)
+
+class FakeInteraction:
+    def __init__(self, user_id: int, guild_id: int, channel: FakeChannel):
+        self.user = FakeUser(user_id)
+        self.guild_id = guild_id
+        self.channel = channel
+        self.trace = InteractionTrace(time.perf_counter())
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, content=None, embed=None):
+        await self.channel.record(self.trace, content, embed)
+        return FakeMessage(self.channel, self.trace)
@@ -0,0 +1,159 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Includes a few Simplified tokens, as real models occasionally slip into them.
+FILLER_TOKENS = ['你好', '，', '我是', '小智', '。', '今天', '想', '聊', '什麼', '呢', '？', '這個', '問題', '很', '有趣', '！', '这个', '问', '题', '以后']
+
+class GroqProfile:
+    def __init__(self, ttft: float = 0.3, tokens_per_second: float = 250.0, completion_tokens: int = 120,
+                 jitter: float = 0.2, slow_start_rate: float = 0.0, slow_start_seconds: float = 3.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, tokens_per_minute: int = 12000):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.jitter = jitter
+        self.slow_start_rate = slow_start_rate
+        self.slow_start_seconds = slow_start_seconds
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.tokens_per_minute = tokens_per_minute
+
+class FakeGroqStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.rate_limited = 0
+        self.completion_tokens = 0
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, rate_limited: bool = False, stream: bool = False, completion_tokens: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.models[model] = self.models.get(model, 0) + 1
+            self.rate_limited += rate_limited
+            self.streams += stream
+            self.completion_tokens += completion_tokens
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'streams': self.streams,
+                'rate_limited': self.rate_limited,
+                'completion_tokens': self.completion_tokens,
+                'models': dict(self.models)
+            }
+
+def _jittered(value: float, jitter: float):
+    return max(0.0, value * random.uniform(1 - jitter, 1 + jitter))
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _ratelimit_headers(self, prompt_tokens: int):
+        profile = self.server.profile
+        return {
+            'x-ratelimit-limit-requests': '14400',
+            'x-ratelimit-remaining-requests': '14399',
+            'x-ratelimit-reset-requests': '6s',
+            'x-ratelimit-limit-tokens': str(profile.tokens_per_minute),
+            'x-ratelimit-remaining-tokens': str(max(0, profile.tokens_per_minute - prompt_tokens)),
+            'x-ratelimit-reset-tokens': '1.5s'
+        }
+
+    def do_POST(self):
+        profile = self.server.profile
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        model = request.get('model', 'unknown')
+        prompt_tokens = sum(len(message.get('content', '')) for message in request.get('messages', []))
+
+        if random.random() < profile.rate_limit_rate:
+            self.server.stats.record(model, rate_limited=True)
+            self._send_json(429, {
+                'error': {'message': 'Rate limit reached (fake)', 'type': 'tokens', 'code': 'rate_limit_exceeded'}
+            }, {'retry-after': str(profile.retry_after), **self._ratelimit_headers(prompt_tokens)})
+            return
+
+        completion_tokens = max(1, int(_jittered(profile.completion_tokens, profile.jitter)))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        text_tokens = [random.choice(FILLER_TOKENS) for _ in range(completion_tokens)]
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+
+        if not request.get('stream'):
+            time.sleep(_jittered(profile.ttft, profile.jitter) + completion_tokens / profile.tokens_per_second)
+            self.server.stats.record(model, completion_tokens=completion_tokens)
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(text_tokens)}, 'finish_reason': 'stop'}],
+                'usage': usage
+            }, self._ratelimit_headers(prompt_tokens))
+            return
+
+        self.server.stats.record(model, stream=True, completion_tokens=completion_tokens)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in self._ratelimit_headers(prompt_tokens).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def event(delta: dict, finish_reason=None, x_groq=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}] if delta is not None else []
+            }
+            if x_groq is not None:
+                payload['x_groq'] = x_groq
+            return f"data: {json.dumps(payload)}\n\n".encode()
+
+        slow = random.random() < profile.slow_start_rate
+        time.sleep(profile.slow_start_seconds if slow else _jittered(profile.ttft, profile.jitter))
+        try:
+            self._write_chunk(event({'role': 'assistant', 'content': ''}))
+            interval = 1 / profile.tokens_per_second
+            for token in text_tokens:
+                time.sleep(interval)
+                self._write_chunk(event({'content': token}))
+            self._write_chunk(event({}, finish_reason='stop'))
+            self._write_chunk(event(None, x_groq={'id': completion_id, 'usage': usage}))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_groq(profile: GroqProfile = None, host: str = '127.0.0.1', port: int = 0):
+    server = ThreadingHTTPServer((host, port), FakeGroqHandler)
+    server.daemon_threads = True
+    server.profile = profile or GroqProfile()
+    server.stats = FakeGroqStats()
+    threading.Thread(target=server.serve_forever, name='fake-groq', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
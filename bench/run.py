@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import http.client
+import importlib.util
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from bench.fake_groq import GroqProfile, start_fake_groq
+from bench.fake_discord import TraceBook, FakeChannel, FakeInteraction, FakeUser, start_fake_discord
+
+PROMPTS = [
+    '你好，你是誰？',
+    '今天的活動幾點開始？',
+    '幫我想三個週末可以做的事情',
+    '請用簡單的方式解釋什麼是黑洞',
+    '推薦一本適合入門的程式設計書',
+    '我想學吉他，應該從哪裡開始？'
+]
+
+COMPARED_METRICS = ('latency_p50', 'latency_p95', 'latency_p99', 'ttft_p50', 'ttft_p95', 'ttft_p99',
+                    'throughput', 'edits_per_request', 'upstream_requests', 'rss_growth_kb')
+
+def percentile(values, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_prompt(args, index: int):
+    if args.same_prompt:
+        return PROMPTS[0]
+    return f"{PROMPTS[index % len(PROMPTS)]}（#{index}）"
+
+def configure_environment(args, groq_url: str, workdir: str):
+    os.environ['GROQ_BASE_URL'] = groq_url
+    os.environ['GROQ_API_KEY'] = 'bench'
+    os.environ['DISCORD_TOKEN'] = 'bench'
+    os.environ['HISTORY_DB_PATH'] = os.path.join(workdir, 'history.sqlite3')
+    os.environ['WEBHOOK_TIMING_REPORT'] = '0'
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', '1' if args.cache else '0')
+    os.environ.setdefault('GROQ_REQUESTS_PER_MINUTE', '1000000')
+    os.environ.setdefault('GROQ_TOKENS_PER_MINUTE', str(args.tokens_per_minute))
+
+def load_webhook():
+    spec = importlib.util.spec_from_file_location('bench_webhook', os.path.join(ROOT_DIR, 'api', 'webhook.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_webhook(args, book: TraceBook, discord_url: str):
+    from nacl.signing import SigningKey
+
+    signing_key = SigningKey.generate()
+    os.environ['DISCORD_PUBLIC_KEY'] = signing_key.verify_key.encode().hex()
+    webhook = load_webhook()
+    webhook.DISCORD_API_BASE = discord_url
+
+    if args.mode == 'server':
+        from smartie.server import BackgroundTasks, PooledHTTPServer
+
+        webhook.background_tasks = BackgroundTasks()
+        server = PooledHTTPServer(('127.0.0.1', 0), webhook.Handler)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), webhook.Handler)
+        server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-webhook', daemon=True).start()
+    connections = threading.local()
+
+    def connect():
+        if args.mode != 'server':
+            return http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=args.timeout)
+        if getattr(connections, 'current', None) is None:
+            connections.current = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=args.timeout)
+        return connections.current
+
+    def send(index: int):
+        token = f"bench-{index}"
+        trace = book.start(token)
+        body = json.dumps({
+            'type': 2,
+            'application_id': 'bench',
+            'token': token,
+            'guild_id': str(index % args.guilds),
+            'member': {'user': {'id': str(index % args.users)}},
+            'data': {'name': '小智', 'options': [{'name': 'message', 'value': make_prompt(args, index)}]}
+        }).encode()
+        timestamp = str(int(time.time()))
+        signature = signing_key.sign(timestamp.encode() + body).signature.hex()
+        connection = connect()
+        try:
+            connection.request('POST', '/', body, {
+                'Content-Type': 'application/json',
+                'X-Signature-Ed25519': signature,
+                'X-Signature-Timestamp': timestamp
+            })
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            response = None
+            trace.error = type(e).__name__
+        if response is None or response.will_close or args.mode != 'server':
+            connection.close()
+            connections.current = None
+        if response is not None and response.status != 200:
+            trace.error = f"HTTP {response.status}"
+        if trace.error is not None:
+            trace.finished = time.perf_counter()
+            return
+        reply = json.loads(payload or b'{}')
+        if reply.get('type') == 4:
+            embed = (reply['data'].get('embeds') or [{}])[0]
+            book.observe(token, embed.get('description'), (embed.get('footer') or {}).get('text'), embed.get('color'))
+            if trace.finished is None:
+                trace.error = 'rejected'
+                trace.finished = time.perf_counter()
+            return
+        if not book.wait(token, args.timeout):
+            trace.error = 'timeout'
+
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    if args.mode == 'server':
+        server.stop_workers(args.timeout)
+        webhook.background_tasks.drain(args.timeout)
+    return list(book.traces.values()), elapsed, rss_before
+
+def run_bot(args):
+    import main
+
+    main.bot._connection.user = FakeUser(0)
+    channel = FakeChannel(args.edit_latency)
+    traces = []
+
+    async def drive():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(index: int):
+            async with semaphore:
+                interaction = FakeInteraction(index % args.users, index % args.guilds, channel)
+                traces.append(interaction.trace)
+                try:
+                    await asyncio.wait_for(main.xiaozhi.callback(interaction, make_prompt(args, index)), args.timeout)
+                except asyncio.TimeoutError:
+                    interaction.trace.error = 'timeout'
+
+        await asyncio.gather(*(one(index) for index in range(args.requests)))
+        await asyncio.sleep(0)
+
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    asyncio.run(drive())
+    return traces, time.perf_counter() - started, rss_before
+
+def summarize(traces, elapsed: float, rss_before: int, groq_stats: dict):
+    completed = [trace for trace in traces if trace.finished is not None and trace.error is None]
+    latencies = [trace.finished - trace.started for trace in completed]
+    ttfts = [trace.first_content - trace.started for trace in completed if trace.first_content is not None]
+    edits = sum(trace.edits for trace in traces)
+    results = {
+        'requests': len(traces),
+        'completed': len(completed),
+        'errors': len(traces) - len(completed),
+        'elapsed_seconds': elapsed,
+        'throughput': len(completed) / elapsed if elapsed > 0 else 0.0,
+        'completion_tokens_per_second': groq_stats['completion_tokens'] / elapsed if elapsed > 0 else 0.0,
+        'edits': edits,
+        'edits_per_request': edits / len(traces) if traces else 0.0,
+        'upstream_requests': groq_stats['requests'],
+        'upstream_rate_limited': groq_stats['rate_limited'],
+        'upstream_models': groq_stats['models'],
+        'rss_growth_kb': rss_kb() - rss_before,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+    for name, values in (('latency', latencies), ('ttft', ttfts)):
+        for pct in (50, 95, 99):
+            results[f"{name}_p{pct}"] = percentile(values, pct)
+    return results
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"mode={report['mode']} commit={report['commit'] or '-'} requests={report['config']['requests']} concurrency={report['config']['concurrency']}")
+    results = report['results']
+    base_results = baseline['results'] if baseline else {}
+    for name, value in results.items():
+        line = f"  {name:<30} {format_value(value)}"
+        base = base_results.get(name)
+        if name in COMPARED_METRICS and isinstance(value, (int, float)) and isinstance(base, (int, float)):
+            change = f"{(value - base) / base:+.1%}" if base else 'n/a'
+            line += f"  (baseline {format_value(base)}, {change})"
+        print(line)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test for the webhook handler and the gateway bot')
+    parser.add_argument('mode', choices=('webhook', 'server', 'bot'))
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--same-prompt', action='store_true', help='send the same prompt every time')
+    parser.add_argument('--cache', action='store_true', help='enable the response cache')
+    parser.add_argument('--ttft', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=250.0)
+    parser.add_argument('--completion-tokens', type=int, default=120)
+    parser.add_argument('--slow-start-rate', type=float, default=0.0)
+    parser.add_argument('--slow-start-seconds', type=float, default=3.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--tokens-per-minute', type=int, default=10_000_000)
+    parser.add_argument('--edit-latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report from an earlier run to compare against')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = GroqProfile(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        slow_start_rate=args.slow_start_rate,
+        slow_start_seconds=args.slow_start_seconds,
+        rate_limit_rate=args.rate_limit_rate,
+        tokens_per_minute=args.tokens_per_minute
+    )
+    groq_server, groq_url = start_fake_groq(profile)
+
+    with tempfile.TemporaryDirectory(prefix='smartie-bench-') as workdir:
+        configure_environment(args, groq_url, workdir)
+        if args.mode in ('webhook', 'server'):
+            book = TraceBook()
+            discord_server, discord_url = start_fake_discord(book, edit_latency=args.edit_latency)
+            traces, elapsed, rss_before = run_webhook(args, book, discord_url)
+            discord_server.shutdown()
+        else:
+            traces, elapsed, rss_before = run_bot(args)
+    groq_server.shutdown()
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    report = {
+        'mode': args.mode,
+        'commit': git_commit(),
+        'config': config,
+        'results': summarize(traces, elapsed, rss_before, groq_server.stats.as_dict())
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('mode') != report['mode'] or baseline.get('config') != report['config']:
+            print('warning: baseline was recorded with a different mode or configuration')
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
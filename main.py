@@ -1,15 +1,33 @@
 import os
+import math
 import discord
 from discord import app_commands
-from discord.ext import commands
-from groq import Groq
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
 import asyncio
 from pathlib import Path
 
+# smartie modules read their settings at import time, so .env must load first.
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+from smartie.tokens import token_counter, usage_from_chunk
+from smartie.prompts import PromptBuilder, select_variant, LONG_MESSAGE_CHARS
+from smartie.history import HistoryStore, HISTORY_TTL_SECONDS, HISTORY_CACHE_SECONDS
+from smartie.backends import create_backend
+from smartie.clients import get_async_groq_client
+from smartie.render import StreamingEditor
+from smartie.cache import ResponseCache
+from smartie.scheduler import Scheduler
+from smartie.generations import GenerationRegistry
+from smartie.summary import Summarizer
+from smartie.router import ModelRouter
+from smartie.singleflight import SingleFlight, flight_key
+from smartie.zhconvert import traditional_stream
+from smartie.pagination import split_pages, preview_page, page_footer, display_limit, RESPONSE_PAGE_CHARS
+from smartie.metrics import metrics, start_metrics_server, METRICS_LOG_MINUTES, METRICS_PORT
+from smartie.sharding import is_sharded, is_cluster_child, process_count, parse_shard_ids, launch, SHARD_COUNT, SHARD_CLUSTER
+
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 DISCORD_PUBLIC_KEY = os.getenv('DISCORD_PUBLIC_KEY')
@@ -21,54 +39,160 @@ if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY 環境變數未設定，請檢查 .env 檔案")
 
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-groq_client = Groq(api_key=GROQ_API_KEY)
-
-conversation_history = {}
+if is_sharded():
+    bot = commands.AutoShardedBot(
+        command_prefix='!',
+        intents=intents,
+        shard_count=SHARD_COUNT or None,
+        shard_ids=parse_shard_ids()
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
 
 MAX_HISTORY_LENGTH = 10
 MAX_HISTORY_TOKENS = 2000
 
+HISTORY_SWEEP_MINUTES = 10
+PAGE_VIEW_TIMEOUT_SECONDS = 600
+
+# Shard clusters run in separate processes, so history must be read from and
+# written to the shared backend on every access instead of cached locally.
+SHARED_HISTORY = is_cluster_child()
+
+history_store = HistoryStore(
+    MAX_HISTORY_LENGTH,
+    MAX_HISTORY_TOKENS,
+    backend=create_backend(ttl_seconds=HISTORY_TTL_SECONDS, shared=SHARED_HISTORY),
+    cache_seconds=0 if SHARED_HISTORY else HISTORY_CACHE_SECONDS
+)
+response_cache = ResponseCache()
+scheduler = Scheduler()
+generations = GenerationRegistry()
+router = ModelRouter()
+single_flight = SingleFlight()
+summarizer = Summarizer(history_store, GROQ_API_KEY)
+prompt_builder = PromptBuilder(history_store)
+
+metrics.register_stats('history', history_store.stats)
+metrics.register_stats('response_cache', response_cache.stats)
+metrics.register_stats('scheduler', scheduler.stats)
+metrics.register_stats('single_flight', single_flight.stats)
+metrics.register_stats('router', router.stats, label='model')
+
+def gateway_latencies():
+    latencies = bot.latencies if isinstance(bot, commands.AutoShardedBot) else [(0, bot.latency)]
+    return [
+        ('gateway_latency_seconds', latency, {'shard': shard_id})
+        for shard_id, latency in latencies if not math.isnan(latency)
+    ]
+
+metrics.register_collector(gateway_latencies)
+
 @bot.event
 async def on_ready():
     print(f'{bot.user} 已上線')
-    try:
-        synced = await bot.tree.sync()
-        print(f'已同步 {len(synced)} 個全局斜線指令')
-        for cmd in synced:
-            print(f'  - /{cmd.name}')
-        print('提示：全局指令更新可能需要 1-2 小時才會在 Discord 中顯示')
-        print('如果急需使用，可以等待幾分鐘後重新整理 Discord')
-    except Exception as e:
-        print(f'同步指令時發生錯誤: {e}')
+    if bot.shard_count:
+        print(f'分片：{sorted(bot.shards)}（共 {bot.shard_count} 個，叢集 {SHARD_CLUSTER}）')
+    if SHARD_CLUSTER == 0:
+        try:
+            synced = await bot.tree.sync()
+            print(f'已同步 {len(synced)} 個全局斜線指令')
+            for cmd in synced:
+                print(f'  - /{cmd.name}')
+            print('提示：全局指令更新可能需要 1-2 小時才會在 Discord 中顯示')
+            print('如果急需使用，可以等待幾分鐘後重新整理 Discord')
+        except Exception as e:
+            print(f'同步指令時發生錯誤: {e}')
+    else:
+        print('斜線指令由叢集 0 負責同步')
     
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="正在幫助用戶"))
+    
+    if not sweep_history.is_running():
+        sweep_history.start()
+    
+    if METRICS_LOG_MINUTES > 0 and not report_metrics.is_running():
+        report_metrics.start()
+
+@tasks.loop(minutes=max(METRICS_LOG_MINUTES, 1))
+async def report_metrics():
+    lines = metrics.summary_lines()
+    if lines:
+        print("效能指標：\n  " + "\n  ".join(lines))
+
+@tasks.loop(minutes=HISTORY_SWEEP_MINUTES)
+async def sweep_history():
+    expired = history_store.expire()
+    stats = history_store.stats()
+    print(f"對話記憶：{stats['users']} 位用戶、{stats['entries']} 則訊息、約 {stats['bytes'] / 1024:.1f} KB（本次清除 {expired} 筆過期對話，累計淘汰 {stats['evictions']} 筆）")
+    
+    if response_cache.enabled:
+        cache_stats = response_cache.stats()
+        print(f"回應快取：{cache_stats['entries']} 筆、約 {cache_stats['bytes'] / 1024:.1f} KB，命中 {cache_stats['hits']} 次、未命中 {cache_stats['misses']} 次（命中率 {cache_stats['hit_rate']:.1%}）")
+    
+    if router.hedges or router.fallbacks:
+        print(f"模型路由：對沖請求 {router.hedges} 次（勝出 {router.hedge_wins} 次）、備援切換 {router.fallbacks} 次")
+    for model, model_stats in router.stats().items():
+        if model_stats['ttft'] is not None:
+            print(f"模型 {model}：{model_stats['requests']} 次請求、{model_stats['failures']} 次失敗，首字延遲約 {model_stats['ttft']:.2f} 秒、每秒約 {model_stats['tokens_per_second'] or 0:.0f} tokens")
 
 def get_conversation_history(user_id: int):
-    if user_id not in conversation_history:
-        conversation_history[user_id] = []
-    return conversation_history[user_id]
+    return history_store.entries(user_id)
 
 def add_to_history(user_id: int, role: str, content: str):
-    history = get_conversation_history(user_id)
-    history.append({"role": role, "content": content})
+    return history_store.append(user_id, role, content)
+
+class ResponsePages(discord.ui.View):
+    def __init__(self, pages: list, footer_text: str):
+        super().__init__(timeout=PAGE_VIEW_TIMEOUT_SECONDS)
+        self.pages = pages
+        self.footer_text = footer_text
+        self.index = 0
+        self.message = None
+        self._sync_buttons()
     
-    total_tokens = sum(len(msg["content"]) // 3 for msg in history)
+    def embed(self):
+        embed = discord.Embed(
+            description=self.pages[self.index],
+            color=0x5865F2
+        )
+        embed.set_footer(text=page_footer(self.footer_text, self.index, len(self.pages)))
+        embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
+        return embed
     
-    while len(history) > MAX_HISTORY_LENGTH or total_tokens > MAX_HISTORY_TOKENS:
-        removed = history.pop(0)
-        total_tokens -= len(removed["content"]) // 3
-
-def build_messages(system_prompt: str, user_message: str, user_id: int):
-    history = get_conversation_history(user_id)
-    messages = [{"role": "system", "content": system_prompt}]
+    def _sync_buttons(self):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.index == len(self.pages) - 1
     
-    for msg in history:
-        messages.append(msg)
+    async def send(self, interaction: discord.Interaction, message_obj=None):
+        view = self if len(self.pages) > 1 else discord.utils.MISSING
+        if message_obj:
+            self.message = await message_obj.edit(content=None, embed=self.embed(), view=view)
+        else:
+            self.message = await interaction.followup.send(embed=self.embed(), view=view, wait=True)
+    
+    async def _show(self, interaction: discord.Interaction, index: int):
+        self.index = max(0, min(index, len(self.pages) - 1))
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+    
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index - 1)
     
-    messages.append({"role": "user", "content": user_message})
-    return messages
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index + 1)
+    
+    async def on_timeout(self):
+        if self.message is None or len(self.pages) <= 1:
+            return
+        for item in self.children:
+            item.disabled = True
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            pass
 
 @bot.tree.command(name="小智", description="與小智 AI 助手對話")
 @app_commands.describe(message="要發送的訊息")
@@ -87,128 +211,145 @@ async def xiaozhi(interaction: discord.Interaction, message: str):
         await interaction.followup.send("訊息長度不能超過 2000 字元")
         return
     
+    request_metrics = metrics.request('小智')
+    outcome = 'ok'
+    
     try:
-        message_length = len(message)
-        
-        if message_length > 1500:
+        if len(message) > LONG_MESSAGE_CHARS:
             await interaction.followup.send("⚠️ 偵測到長訊息，正在處理中...")
         
-        history = get_conversation_history(user_id)
-        history_tokens = sum(len(msg["content"]) // 3 for msg in history)
-        estimated_tokens = message_length // 3
-        available_tokens = 4096 - history_tokens - estimated_tokens - 200
-        max_tokens_value = max(512, min(2048, available_tokens))
-        
-        if message_length > 1500:
-            system_prompt = "你是一個友善、自然的 AI 助手，由 Groq AI 提供技術支援。你的名字是小智，專門在 Discord 伺服器中幫助用戶回答問題和進行對話。\n\n重要：你必須且只能使用繁體中文回應，絕對不能使用簡體中文。所有回應都必須使用繁體中文字體，包括標點符號。如果遇到簡體中文輸入，請在回應時轉換為繁體中文。\n\n請用繁體中文以自然、口語化的方式回應，就像和朋友聊天一樣。避免使用過於正式或生硬的語氣，讓對話更流暢自然。當被問到你是誰、你的身分或相關問題時，請自然地介紹自己是小智。\n\n注意：用戶的訊息較長，請簡潔地回應重點。"
-        else:
-            system_prompt = "你是一個友善、自然的 AI 助手，由 Groq AI 提供技術支援。你的名字是小智，專門在 Discord 伺服器中幫助用戶回答問題和進行對話。\n\n重要：你必須且只能使用繁體中文回應，絕對不能使用簡體中文。所有回應都必須使用繁體中文字體，包括標點符號。如果遇到簡體中文輸入，請在回應時轉換為繁體中文。\n\n請用繁體中文以自然、口語化的方式回應，就像和朋友聊天一樣。避免使用過於正式或生硬的語氣，讓對話更流暢自然。當被問到你是誰、你的身分或相關問題時，請自然地介紹自己是小智。"
-        
-        messages = build_messages(system_prompt, message, user_id)
-        
-        response_text = ""
+        variant = select_variant(message)
+        cache_key = response_cache.make_key(message, variant.name, get_conversation_history(user_id))
+        cached_text = response_cache.get(cache_key)
         message_obj = None
-        update_queue = asyncio.Queue()
-        update_interval = 1.5
+        stopped = False
         
-        async def update_message_periodically():
-            nonlocal message_obj
-            last_text = ""
+        if cached_text is not None:
+            response_text = cached_text
+            request_metrics.model = 'cache'
+            outcome = 'cached'
+        else:
+            messages, prompt_tokens, max_tokens_value = prompt_builder.prepare(variant, message, user_id)
+            request_metrics.prompt(prompt_tokens, history_store.tokens(user_id))
             
-            while True:
+            async def edit_preview(text: str):
+                nonlocal message_obj
+                preview_text, page_count = preview_page(text)
+                
+                embed = discord.Embed(
+                    description=preview_text,
+                    color=0x5865F2
+                )
+                embed.set_footer(text=page_footer("⏳ 正在生成回應...", page_count - 1, page_count))
+                embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
+                
+                edit_started = time.perf_counter()
+                if message_obj:
+                    await message_obj.edit(content=None, embed=embed)
+                else:
+                    message_obj = await interaction.followup.send(embed=embed)
+                request_metrics.edited(time.perf_counter() - edit_started)
+            
+            generation_started = False
+            
+            async def show_queue_position(position: int):
+                nonlocal message_obj
+                if generation_started:
+                    return
                 try:
-                    current_text = await asyncio.wait_for(update_queue.get(), timeout=update_interval)
-                    if current_text == "DONE":
-                        break
-                    
-                    if current_text != last_text and len(current_text) > 50:
-                        preview_text = current_text[:1900] + ("..." if len(current_text) > 1900 else "")
-                        
-                        embed = discord.Embed(
-                            description=preview_text,
-                            color=0x5865F2
-                        )
-                        embed.set_footer(text="⏳ 正在生成回應...")
-                        embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
-                        
-                        try:
-                            if message_obj:
-                                await message_obj.edit(embed=embed)
-                            else:
-                                message_obj = await interaction.followup.send(embed=embed)
-                            last_text = current_text
-                        except:
-                            pass
-                except asyncio.TimeoutError:
-                    if last_text:
-                        preview_text = last_text[:1900] + ("..." if len(last_text) > 1900 else "")
-                        embed = discord.Embed(
-                            description=preview_text,
-                            color=0x5865F2
-                        )
-                        embed.set_footer(text="⏳ 正在生成回應...")
-                        embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
-                        
-                        try:
-                            if message_obj:
-                                await message_obj.edit(embed=embed)
-                        except:
-                            pass
-        
-        def stream_response():
-            nonlocal response_text
+                    message_obj = await interaction.edit_original_response(content=f"⏳ 目前排隊中，你排在第 {position} 位，請稍候...")
+                except discord.HTTPException as e:
+                    print(f"更新排隊位置時發生錯誤: {e}")
             
-            stream = groq_client.chat.completions.create(
-                messages=messages,
-                model="llama-3.3-70b-versatile",
-                temperature=0.7,
-                max_tokens=max_tokens_value,
-                stream=True
-            )
+            async def stream_response(editor: StreamingEditor):
+                candidates = router.candidates(message, max_tokens_value)
+                shareable = len(messages) == 2
+                stream = single_flight.subscribe(
+                    flight_key(candidates[0], variant.content, message, max_tokens_value) if shareable else None,
+                    lambda: router.open_stream(
+                        scheduler,
+                        lambda model: get_async_groq_client(GROQ_API_KEY).chat.completions.with_raw_response.create(
+                            messages=messages,
+                            model=model,
+                            temperature=0.7,
+                            max_tokens=max_tokens_value,
+                            stream=True
+                        ),
+                        candidates,
+                        prompt_tokens
+                    )
+                )
+                
+                conversion = traditional_stream()
+                try:
+                    async for chunk in stream:
+                        if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                            request_metrics.token()
+                            editor.push(conversion.feed(chunk.choices[0].delta.content))
+                            if editor.full:
+                                break
+                        
+                        usage = usage_from_chunk(chunk)
+                        if usage is not None:
+                            request_metrics.completed_tokens(usage.completion_tokens)
+                            if stream.leader:
+                                token_counter.calibrate(prompt_tokens, usage.prompt_tokens)
+                                token_counter.observe_output(editor.buffer.length, usage.completion_tokens)
+                                scheduler.charge_tokens(usage.completion_tokens)
+                finally:
+                    editor.push(conversion.flush())
+                    request_metrics.model = stream.model
+                    await stream.close()
             
-            for chunk in stream:
-                if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    response_text += chunk.choices[0].delta.content
+            async def run_generation():
+                nonlocal generation_started, response_text
+                async with scheduler.slot(user_id, interaction.guild_id, on_position=show_queue_position):
+                    generation_started = True
+                    request_metrics.queued()
+                    editor = StreamingEditor(edit_preview, max_chars=display_limit()).start()
                     try:
-                        update_queue.put_nowait(response_text)
-                    except:
-                        pass
+                        await asyncio.wait_for(stream_response(editor), timeout=60.0)
+                    except BaseException:
+                        response_text = editor.cancel()
+                        raise
+                    response_text = await editor.close()
             
-            update_queue.put_nowait("DONE")
-            return response_text
-        
-        update_task = asyncio.create_task(update_message_periodically())
-        
-        loop = asyncio.get_event_loop()
-        response_text = await asyncio.wait_for(
-            loop.run_in_executor(None, stream_response),
-            timeout=60.0
-        )
-        
-        await update_task
+            response_text = ""
+            generation = generations.start(user_id, run_generation())
+            try:
+                await generation.task
+            except asyncio.CancelledError:
+                if not generation.stopped:
+                    raise
+                stopped = True
+                outcome = 'stopped'
+            
+            if not stopped and len(response_text) <= RESPONSE_PAGE_CHARS:
+                response_cache.put(cache_key, response_text)
         
-        add_to_history(user_id, "user", message)
-        add_to_history(user_id, "assistant", response_text)
+        if stopped:
+            pages = ResponsePages(split_pages(response_text or "🛑 已停止生成回應"), f"🛑 已停止生成 · ⏱️ {time.time() - start_time:.2f} 秒")
+            await pages.send(interaction, message_obj)
+            return
         
-        if len(response_text) > 2000:
-            response_text = response_text[:1997] + "..."
+        evicted = add_to_history(user_id, "user", message)
+        evicted += add_to_history(user_id, "assistant", response_text)
+        conversation_id = history_store.conversation_id(user_id)
         
         elapsed_time = time.time() - start_time
         response_time_text = f"⏱️ 回應時間: {elapsed_time:.2f} 秒"
+        if cached_text is not None:
+            response_time_text += " · ⚡ 快取"
         
-        embed = discord.Embed(
-            description=response_text,
-            color=0x5865F2
-        )
-        embed.set_footer(text=response_time_text)
-        embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
+        edit_started = time.perf_counter()
+        await ResponsePages(split_pages(response_text), response_time_text).send(interaction, message_obj)
+        request_metrics.edited(time.perf_counter() - edit_started)
         
-        if message_obj:
-            await message_obj.edit(embed=embed)
-        else:
-            await interaction.followup.send(embed=embed)
+        summarizer.schedule(user_id, evicted, conversation_id)
         
-    except asyncio.TimeoutError:
+    except asyncio.TimeoutError as e:
+        outcome = 'timeout'
+        request_metrics.error(e)
         embed = discord.Embed(
             description="⏰ 抱歉，處理時間過長，請稍後再試",
             color=0xFF0000
@@ -216,6 +357,8 @@ async def xiaozhi(interaction: discord.Interaction, message: str):
         embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
         await interaction.followup.send(embed=embed)
     except Exception as e:
+        outcome = 'error'
+        request_metrics.error(e)
         error_msg = str(e)
         embed = discord.Embed(color=0xFF0000)
         embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
@@ -232,13 +375,29 @@ async def xiaozhi(interaction: discord.Interaction, message: str):
             print(f"錯誤詳情: {error_msg}")
         
         await interaction.followup.send(embed=embed)
+    finally:
+        request_metrics.finish(outcome)
+
+@bot.tree.command(name="停止", description="停止小智正在生成的回應")
+async def stop_generation(interaction: discord.Interaction):
+    if generations.stop(interaction.user.id):
+        embed = discord.Embed(
+            description="🛑 已停止生成回應",
+            color=0x00FF00
+        )
+    else:
+        embed = discord.Embed(
+            description="ℹ️ 目前沒有正在生成的回應",
+            color=0x5865F2
+        )
+    embed.set_author(name="小智", icon_url=bot.user.avatar.url if bot.user.avatar else None)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="清除記憶", description="清除與小智的對話記憶")
 async def clear_memory(interaction: discord.Interaction):
     user_id = interaction.user.id
     
-    if user_id in conversation_history:
-        conversation_history[user_id] = []
+    if history_store.clear(user_id):
         embed = discord.Embed(
             description="✅ 已清除對話記憶",
             color=0x00FF00
@@ -254,5 +413,15 @@ async def clear_memory(interaction: discord.Interaction):
         await interaction.response.send_message(embed=embed)
 
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    if process_count() > 1 and not is_cluster_child():
+        history_store.backend.close()
+        raise SystemExit(launch(__file__, DISCORD_TOKEN))
+    if METRICS_PORT:
+        metrics_port = METRICS_PORT + SHARD_CLUSTER
+        start_metrics_server(metrics, metrics_port)
+        print(f'效能指標端點：http://127.0.0.1:{metrics_port}/metrics')
+    try:
+        bot.run(DISCORD_TOKEN)
+    finally:
+        history_store.backend.close()
 
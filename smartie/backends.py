@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', '')
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', '')
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1.0'))
+HISTORY_FLUSH_BATCH_SIZE = int(os.getenv('HISTORY_FLUSH_BATCH_SIZE', '64'))
+HISTORY_PURGE_INTERVAL = float(os.getenv('HISTORY_PURGE_INTERVAL', '600'))
+
+class HistoryBackend:
+    persistent = False
+
+    def load(self, user_id):
+        return None
+
+    def save(self, user_id, snapshot: dict):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+    def flush(self):
+        return 0
+
+    def close(self):
+        pass
+
+class SQLiteHistoryBackend(HistoryBackend):
+    persistent = True
+
+    def __init__(self, path: str, flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 batch_size: int = HISTORY_FLUSH_BATCH_SIZE, ttl_seconds: float = 0,
+                 purge_interval: float = HISTORY_PURGE_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self.purged = 0
+        self._purged_at = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = None
+        self._connection = None
+
+    def _connect(self):
+        # Opened on first use so cold starts that never touch history skip it; callers hold _db_lock.
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS conversations ('
+                'user_id TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)')
+            self._connection = connection
+        return self._connection
+
+    def load(self, user_id):
+        key = str(user_id)
+        with self._pending_lock:
+            if key in self._pending:
+                return self._pending[key]
+        with self._db_lock:
+            row = self._connect().execute(
+                'SELECT snapshot, updated_at FROM conversations WHERE user_id = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        snapshot, updated_at = row
+        if self.ttl_seconds > 0 and time.time() - updated_at > self.ttl_seconds:
+            return None
+        return json.loads(snapshot)
+
+    def _queue(self, user_id, snapshot):
+        with self._pending_lock:
+            self._pending[str(user_id)] = snapshot
+            pending_count = len(self._pending)
+        if pending_count >= self.batch_size:
+            self.flush()
+        elif self.flush_interval > 0:
+            self._ensure_flusher()
+            self._wakeup.set()
+
+    def save(self, user_id, snapshot: dict):
+        self._queue(user_id, snapshot)
+
+    def delete(self, user_id):
+        self._queue(user_id, None)
+
+    def flush(self):
+        # Snapshots stay in _pending, visible to load(), until their write commits.
+        # Holding _db_lock throughout keeps an older flush from overwriting a newer one.
+        with self._db_lock:
+            with self._pending_lock:
+                if not self._pending:
+                    return 0
+                pending = dict(self._pending)
+
+            now = time.time()
+            upserts = [(user_id, json.dumps(snapshot, ensure_ascii=False), now) for user_id, snapshot in pending.items() if snapshot is not None]
+            deletes = [(user_id,) for user_id, snapshot in pending.items() if snapshot is None]
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN')
+                if upserts:
+                    connection.executemany(
+                        'INSERT INTO conversations (user_id, snapshot, updated_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET snapshot = excluded.snapshot, updated_at = excluded.updated_at',
+                        upserts
+                    )
+                if deletes:
+                    connection.executemany('DELETE FROM conversations WHERE user_id = ?', deletes)
+
+            with self._pending_lock:
+                for user_id, snapshot in pending.items():
+                    if user_id in self._pending and self._pending[user_id] is snapshot:
+                        del self._pending[user_id]
+            self._purge_expired(now)
+        return len(pending)
+
+    def _purge_expired(self, now: float):
+        # Expired rows are never read again; delete them so the file stays bounded like memory.
+        if self.ttl_seconds <= 0 or (self._purged_at is not None and now - self._purged_at < self.purge_interval):
+            return
+        self._purged_at = now
+        cursor = self._connection.execute('DELETE FROM conversations WHERE updated_at < ?', (now - self.ttl_seconds,))
+        self.purged += max(cursor.rowcount, 0)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or self._closed:
+            return
+        with self._pending_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='history-flusher', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"History flush failed: {e}")
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        with self._db_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+def create_backend(name: str = HISTORY_BACKEND, path: str = HISTORY_DB_PATH, ttl_seconds: float = 0, shared: bool = False):
+    name = (name or 'memory').lower()
+    if name == 'memory':
+        if shared:
+            raise ValueError("HISTORY_BACKEND=memory cannot be shared between processes")
+        return HistoryBackend()
+    if name == 'sqlite':
+        # Shared stores write through so other processes see every update at once.
+        batch_size = 1 if shared else HISTORY_FLUSH_BATCH_SIZE
+        return SQLiteHistoryBackend(path or 'smartie_history.sqlite3', batch_size=batch_size, ttl_seconds=ttl_seconds)
+    raise ValueError(f"Unknown HISTORY_BACKEND: {name}")
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '0') == '1'
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = '?？!！.。~～,，、 '
+
+def normalize_message(text: str):
+    text = unicodedata.normalize('NFKC', text)
+    text = _WHITESPACE_PATTERN.sub(' ', text).strip().lower()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+def history_digest(entries):
+    digest = hashlib.blake2b(digest_size=16)
+    for entry in entries:
+        digest.update(entry.role.encode())
+        digest.update(b'\0')
+        digest.update(entry.content.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class CachedResponse:
+    __slots__ = ('text', 'expires_at', 'size')
+
+    def __init__(self, text: str, expires_at: float, size: int):
+        self.text = text
+        self.expires_at = expires_at
+        self.size = size
+
+class ResponseCache:
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.resident_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, message: str, prompt_variant: str, history_entries=()):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(prompt_variant.encode())
+        digest.update(b'\0')
+        digest.update(history_digest(history_entries).encode())
+        digest.update(b'\0')
+        digest.update(normalize_message(message).encode())
+        return digest.hexdigest()
+
+    def _drop(self, key: str):
+        cached = self._entries.pop(key)
+        self.resident_bytes -= cached.size
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached.expires_at < time.monotonic():
+                self._drop(key)
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached.text
+
+    def put(self, key: str, text: str):
+        if not self.enabled or not text:
+            return
+        size = sys.getsizeof(text) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = CachedResponse(text, time.monotonic() + self.ttl_seconds, size)
+            self.resident_bytes += size
+            while len(self._entries) > self.max_entries or self.resident_bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.resident_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import threading
+
+GROQ_POOL_MAX_CONNECTIONS = int(os.getenv('GROQ_POOL_MAX_CONNECTIONS', '200'))
+GROQ_POOL_KEEPALIVE_CONNECTIONS = int(os.getenv('GROQ_POOL_KEEPALIVE_CONNECTIONS', '50'))
+GROQ_TIMEOUT_SECONDS = float(os.getenv('GROQ_TIMEOUT_SECONDS', '60'))
+GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', '0'))
+DISCORD_HTTP_MAX_CONNECTIONS = int(os.getenv('DISCORD_HTTP_MAX_CONNECTIONS', '100'))
+
+_groq_clients = {}
+_http_clients = {}
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def get_async_groq_client(api_key: str = None):
+    loop = asyncio.get_running_loop()
+    client = _groq_clients.get(loop)
+    if client is None:
+        import httpx
+        from groq import AsyncGroq
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=GROQ_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_POOL_KEEPALIVE_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(GROQ_TIMEOUT_SECONDS, connect=5.0)
+        )
+        client = AsyncGroq(
+            api_key=api_key or os.getenv('GROQ_API_KEY'),
+            http_client=http_client,
+            max_retries=GROQ_MAX_RETRIES
+        )
+        _groq_clients[loop] = client
+    return client
+
+def get_http_client():
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        import httpx
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=DISCORD_HTTP_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(10.0, connect=5.0)
+        )
+        _http_clients[loop] = client
+    return client
+
+def get_background_loop():
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='smartie-loop', daemon=True)
+                thread.start()
+                _background_loop = loop
+    return _background_loop
+
+def run_in_background_loop(coro, timeout: float = None):
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result(timeout)
@@ -0,0 +1,37 @@
+import asyncio
+
+class Generation:
+    __slots__ = ('user_id', 'task', 'stopped')
+
+    def __init__(self, user_id, task: asyncio.Task):
+        self.user_id = user_id
+        self.task = task
+        self.stopped = False
+
+    def stop(self):
+        if self.task.done():
+            return False
+        self.stopped = True
+        self.task.cancel()
+        return True
+
+class GenerationRegistry:
+    def __init__(self):
+        self._active = {}
+
+    def start(self, user_id, coro):
+        generation = Generation(user_id, asyncio.ensure_future(coro))
+        self._active.setdefault(user_id, set()).add(generation)
+        generation.task.add_done_callback(lambda task: self._discard(generation))
+        return generation
+
+    def _discard(self, generation: Generation):
+        generations = self._active.get(generation.user_id)
+        if generations is None:
+            return
+        generations.discard(generation)
+        if not generations:
+            del self._active[generation.user_id]
+
+    def stop(self, user_id):
+        return sum(1 for generation in list(self._active.get(user_id, ())) if generation.stop())
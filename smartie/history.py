@@ -0,0 +1,226 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from smartie.backends import HistoryBackend
+from smartie.tokens import token_counter
+
+HISTORY_MAX_USERS = int(os.getenv('HISTORY_MAX_USERS', '10000'))
+HISTORY_MAX_BYTES = int(os.getenv('HISTORY_MAX_BYTES', str(64 * 1024 * 1024)))
+HISTORY_TTL_SECONDS = float(os.getenv('HISTORY_TTL_SECONDS', str(6 * 60 * 60)))
+HISTORY_CACHE_SECONDS = float(os.getenv('HISTORY_CACHE_SECONDS', '5'))
+
+ENTRY_OVERHEAD_BYTES = 96 + sys.getsizeof({"role": "", "content": ""})
+SUMMARY_PREFIX = "以下是你與這位用戶先前對話的摘要：\n"
+CONVERSATION_OVERHEAD_BYTES = 768
+
+class HistoryEntry:
+    __slots__ = ('role', 'content', 'tokens', 'size', 'message')
+
+    def __init__(self, role: str, content: str, tokens: int):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+        self.size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(content)
+        self.message = {"role": role, "content": content}
+
+class Conversation:
+    __slots__ = ('conversation_id', 'entries', 'total_tokens', 'summary', 'summary_tokens', 'summary_message', 'size', 'last_access', 'loaded_at')
+
+    def __init__(self, max_length: int, conversation_id: str = None):
+        # Identifies this conversation across /清除記憶, so late summaries of a cleared one are dropped.
+        self.conversation_id = conversation_id if conversation_id is not None else uuid.uuid4().hex
+        self.entries = deque(maxlen=max_length)
+        self.total_tokens = 0
+        self.summary = ''
+        self.summary_tokens = 0
+        self.summary_message = None
+        self.size = CONVERSATION_OVERHEAD_BYTES
+        self.last_access = time.monotonic()
+        self.loaded_at = self.last_access
+
+class HistoryStore:
+    def __init__(self, max_length: int, max_tokens: int, max_users: int = HISTORY_MAX_USERS,
+                 max_bytes: int = HISTORY_MAX_BYTES, ttl_seconds: float = HISTORY_TTL_SECONDS, counter=token_counter,
+                 backend: HistoryBackend = None, cache_seconds: float = HISTORY_CACHE_SECONDS):
+        self.max_length = max_length
+        self.max_tokens = max_tokens
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.counter = counter
+        self.backend = backend if backend is not None else HistoryBackend()
+        self.cache_seconds = cache_seconds
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._conversations = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _is_expired(self, conversation: Conversation, now: float):
+        return self.ttl_seconds > 0 and now - conversation.last_access > self.ttl_seconds
+
+    def _drop(self, user_id):
+        conversation = self._conversations.pop(user_id)
+        self.resident_bytes -= conversation.size
+        return conversation
+
+    def _restore(self, user_id):
+        snapshot = self.backend.load(user_id)
+        if not snapshot or not (snapshot.get('messages') or snapshot.get('summary')):
+            return None
+        conversation = Conversation(self.max_length, snapshot.get('conversation_id', ''))
+        self._apply_summary(conversation, snapshot.get('summary') or '')
+        for role, content in snapshot.get('messages', [])[-self.max_length:]:
+            entry = HistoryEntry(role, content, self.counter.count_message(content))
+            conversation.entries.append(entry)
+            conversation.total_tokens += entry.tokens
+            conversation.size += entry.size
+        self._conversations[user_id] = conversation
+        self.resident_bytes += conversation.size
+        self._enforce_caps(keep_user_id=user_id)
+        return conversation
+
+    def _persist(self, user_id, conversation: Conversation):
+        self.backend.save(user_id, {
+            'conversation_id': conversation.conversation_id,
+            'messages': [[entry.role, entry.content] for entry in conversation.entries],
+            'summary': conversation.summary
+        })
+
+    def _apply_summary(self, conversation: Conversation, summary: str):
+        delta = sys.getsizeof(summary) - sys.getsizeof(conversation.summary)
+        conversation.summary = summary
+        conversation.summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary} if summary else None
+        conversation.summary_tokens = self.counter.count_message(conversation.summary_message['content']) if summary else 0
+        conversation.size += delta
+        return delta
+
+    def _lookup(self, user_id, now: float):
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return self._restore(user_id)
+        if self._is_expired(conversation, now):
+            self._drop(user_id)
+            self.expirations += 1
+            return None
+        if self.backend.persistent and now - conversation.loaded_at > self.cache_seconds:
+            self._drop(user_id)
+            return self._restore(user_id)
+        conversation.last_access = now
+        self._conversations.move_to_end(user_id)
+        return conversation
+
+    def _enforce_caps(self, keep_user_id=None):
+        while self._conversations and (len(self._conversations) > self.max_users or self.resident_bytes > self.max_bytes):
+            oldest_user_id = next(iter(self._conversations))
+            if oldest_user_id == keep_user_id:
+                break
+            self._drop(oldest_user_id)
+            self.evictions += 1
+
+    def expire(self):
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while self._conversations:
+                oldest_user_id, conversation = next(iter(self._conversations.items()))
+                if not self._is_expired(conversation, now):
+                    break
+                self._drop(oldest_user_id)
+                removed += 1
+            self.expirations += removed
+        return removed
+
+    def entries(self, user_id):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            return tuple(conversation.entries) if conversation is not None else ()
+
+    def tokens(self, user_id):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            return conversation.total_tokens + conversation.summary_tokens if conversation is not None else 0
+
+    def summary(self, user_id):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            return conversation.summary if conversation is not None else ''
+
+    def conversation_id(self, user_id):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            return conversation.conversation_id if conversation is not None else None
+
+    def set_summary(self, user_id, summary: str, conversation_id: str = None):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            if conversation is None:
+                return False
+            if conversation_id is not None and conversation.conversation_id != conversation_id:
+                return False
+            self.resident_bytes += self._apply_summary(conversation, summary)
+            self._persist(user_id, conversation)
+            self._enforce_caps(keep_user_id=user_id)
+            return True
+
+    def context(self, user_id):
+        with self._lock:
+            conversation = self._lookup(user_id, time.monotonic())
+            if conversation is None:
+                return None, 0, ()
+            return conversation.summary_message, conversation.summary_tokens, tuple(conversation.entries)
+
+    def append(self, user_id, role: str, content: str):
+        entry = HistoryEntry(role, content, self.counter.count_message(content))
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            conversation = self._lookup(user_id, now)
+            if conversation is None:
+                conversation = Conversation(self.max_length)
+                self._conversations[user_id] = conversation
+                self.resident_bytes += conversation.size
+
+            entries = conversation.entries
+            if len(entries) == entries.maxlen:
+                evicted.append(entries.popleft())
+            entries.append(entry)
+            conversation.total_tokens += entry.tokens - sum(removed.tokens for removed in evicted)
+
+            while entries and self.counter.scaled(conversation.total_tokens) > self.max_tokens:
+                removed = entries.popleft()
+                conversation.total_tokens -= removed.tokens
+                evicted.append(removed)
+
+            delta = entry.size - sum(removed.size for removed in evicted)
+            conversation.size += delta
+            self.resident_bytes += delta
+
+            self._persist(user_id, conversation)
+            self._enforce_caps(keep_user_id=user_id)
+        return evicted
+
+    def clear(self, user_id):
+        with self._lock:
+            if self._lookup(user_id, time.monotonic()) is None:
+                return False
+            self._drop(user_id)
+            self.backend.delete(user_id)
+            return True
+
+    def flush(self):
+        return self.backend.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._conversations),
+                'entries': sum(len(conversation.entries) for conversation in self._conversations.values()),
+                'bytes': self.resident_bytes,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
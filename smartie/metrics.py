@@ -0,0 +1,236 @@
+import bisect
+import os
+import threading
+import time
+
+METRICS_LOG_MINUTES = float(os.getenv('METRICS_LOG_MINUTES', '10'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+METRIC_PREFIX = 'smartie_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096)
+
+HISTOGRAMS = {
+    'signature_verify_seconds': LATENCY_BUCKETS,
+    'webhook_phase_seconds': LATENCY_BUCKETS,
+    'queue_wait_seconds': LATENCY_BUCKETS,
+    'ttft_seconds': LATENCY_BUCKETS,
+    'tokens_per_second': RATE_BUCKETS,
+    'completion_seconds': LATENCY_BUCKETS,
+    'discord_edit_seconds': LATENCY_BUCKETS,
+    'discord_edits': COUNT_BUCKETS,
+    'prompt_tokens': TOKEN_BUCKETS,
+    'history_tokens': TOKEN_BUCKETS
+}
+
+def _label_key(labels: dict):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+def _escape(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+class MetricsRegistry:
+    def __init__(self):
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        if value is None:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(HISTOGRAMS.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def register_stats(self, prefix: str, stats, label: str = 'key'):
+        def collect():
+            gauges = []
+            for name, value in stats().items():
+                if isinstance(value, dict):
+                    gauges.extend(
+                        (f"{prefix}_{sub_name}", sub_value, {label: name})
+                        for sub_name, sub_value in value.items() if isinstance(sub_value, (int, float))
+                    )
+                elif isinstance(value, (int, float)):
+                    gauges.append((f"{prefix}_{name}", value, {}))
+            return gauges
+        self.register_collector(collect)
+
+    def request(self, command: str):
+        return RequestMetrics(self, command)
+
+    def _gauges(self):
+        gauges = []
+        for collector in self._collectors:
+            try:
+                gauges.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return gauges
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            for (name, label_key), histogram in histograms:
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(label_key, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(label_key, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(label_key)} {histogram.total}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(label_key)} {histogram.count}")
+            for (name, label_key), value in counters:
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(label_key)} {value}")
+        for name, value, labels in self._gauges():
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(_label_key(labels))} {value}")
+        lines.append(f"{METRIC_PREFIX}uptime_seconds {time.time() - self.started:.0f}")
+        return '\n'.join(lines) + '\n'
+
+    def summary_lines(self):
+        lines = []
+        with self._lock:
+            for (name, label_key), histogram in sorted(self._histograms.items()):
+                labels = ','.join(f"{label}={value}" for label, value in label_key)
+                lines.append(
+                    f"{name}[{labels}] count={histogram.count} mean={histogram.total / histogram.count:.3f} "
+                    f"p50<={histogram.quantile(0.5)} p95<={histogram.quantile(0.95)} p99<={histogram.quantile(0.99)}"
+                )
+            for (name, label_key), value in sorted(self._counters.items()):
+                labels = ','.join(f"{label}={value}" for label, value in label_key)
+                lines.append(f"{name}[{labels}] {value}")
+        for name, value, labels in self._gauges():
+            label_text = ','.join(f"{label}={label_value}" for label, label_value in sorted(labels.items()))
+            lines.append(f"{name}[{label_text}] {value}")
+        return lines
+
+class RequestMetrics:
+    def __init__(self, registry: MetricsRegistry, command: str):
+        self.registry = registry
+        self.command = command
+        self.model = None
+        self.started = time.perf_counter()
+        self.slot_acquired = None
+        self.first_token = None
+        self.edits = 0
+        self.finished = False
+        self._observations = []
+        self._errors = []
+
+    def _observe(self, name: str, value: float):
+        self._observations.append((name, value))
+
+    def queued(self):
+        self.slot_acquired = time.perf_counter()
+        self._observe('queue_wait_seconds', self.slot_acquired - self.started)
+
+    def token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            self._observe('ttft_seconds', self.first_token - (self.slot_acquired or self.started))
+
+    def completed_tokens(self, completion_tokens: int):
+        if self.first_token is None or not completion_tokens:
+            return
+        elapsed = time.perf_counter() - self.first_token
+        if elapsed > 0:
+            self._observe('tokens_per_second', completion_tokens / elapsed)
+
+    def edited(self, seconds: float):
+        self.edits += 1
+        self._observe('discord_edit_seconds', seconds)
+
+    def prompt(self, prompt_tokens: int, history_tokens: int):
+        self._observe('prompt_tokens', prompt_tokens)
+        self._observe('history_tokens', history_tokens)
+
+    def error(self, error: BaseException):
+        self._errors.append(type(error).__name__)
+
+    def finish(self, outcome: str = 'ok'):
+        if self.finished:
+            return
+        self.finished = True
+        self._observe('completion_seconds', time.perf_counter() - self.started)
+        self._observe('discord_edits', self.edits)
+        labels = {'command': self.command, 'model': self.model or 'none'}
+        for name, value in self._observations:
+            self.registry.observe(name, value, **labels)
+        for error_class in self._errors:
+            self.registry.increment('errors_total', error=error_class, **labels)
+        self.registry.increment('requests_total', outcome=outcome, **labels)
+
+def start_metrics_server(registry: MetricsRegistry, port: int = METRICS_PORT, host: str = '127.0.0.1'):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='smartie-metrics', daemon=True).start()
+    return server
+
+metrics = MetricsRegistry()
@@ -0,0 +1,40 @@
+import os
+
+RESPONSE_PAGE_CHARS = 2000
+RESPONSE_MAX_PAGES = max(int(os.getenv('RESPONSE_MAX_PAGES', '1')), 1)
+PREVIEW_CHARS = 1900
+TRUNCATION_MARK = "..."
+
+PAGE_BREAKS = ('\n\n', '\n', '。', '！', '？', '. ', '! ', '? ', '，', ', ', ' ')
+
+def display_limit(max_pages: int = RESPONSE_MAX_PAGES, page_chars: int = RESPONSE_PAGE_CHARS):
+    return max_pages * page_chars
+
+def _break_point(text: str, limit: int):
+    window = text[:limit]
+    for separator in PAGE_BREAKS:
+        index = window.rfind(separator)
+        if index >= limit // 2:
+            return index + len(separator)
+    return limit
+
+def split_pages(text: str, page_chars: int = RESPONSE_PAGE_CHARS):
+    pages = []
+    while len(text) > page_chars:
+        cut = _break_point(text, page_chars)
+        pages.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    pages.append(text)
+    return pages
+
+def preview_page(text: str, page_chars: int = RESPONSE_PAGE_CHARS):
+    pages = split_pages(text, page_chars)
+    preview = pages[-1]
+    if len(preview) > PREVIEW_CHARS:
+        preview = preview[:PREVIEW_CHARS] + TRUNCATION_MARK
+    return preview, len(pages)
+
+def page_footer(footer_text: str, index: int, page_count: int):
+    if page_count <= 1:
+        return footer_text
+    return f"{footer_text} · 第 {index + 1}/{page_count} 頁"
@@ -0,0 +1,76 @@
+import sys
+from itertools import islice
+
+from smartie.tokens import token_counter, MIN_COMPLETION_TOKENS, PROMPT_OVERHEAD_TOKENS
+from smartie.zhconvert import SCRIPT_CONVERSION_ENABLED
+from smartie.pagination import display_limit
+
+LONG_MESSAGE_CHARS = 1500
+
+# Only needed when the output is not converted locally; see smartie.zhconvert.
+SCRIPT_INSTRUCTION = "\n\n重要：你必須且只能使用繁體中文回應，絕對不能使用簡體中文。所有回應都必須使用繁體中文字體，包括標點符號。如果遇到簡體中文輸入，請在回應時轉換為繁體中文。"
+
+BASE_SYSTEM_PROMPT = (
+    "你是一個友善、自然的 AI 助手，由 Groq AI 提供技術支援。你的名字是小智，專門在 Discord 伺服器中幫助用戶回答問題和進行對話。"
+    + ("" if SCRIPT_CONVERSION_ENABLED else SCRIPT_INSTRUCTION)
+    + "\n\n請用繁體中文以自然、口語化的方式回應，就像和朋友聊天一樣。避免使用過於正式或生硬的語氣，讓對話更流暢自然。當被問到你是誰、你的身分或相關問題時，請自然地介紹自己是小智。"
+)
+LONG_MESSAGE_NOTE = "\n\n注意：用戶的訊息較長，請簡潔地回應重點。"
+
+class PromptVariant:
+    __slots__ = ('name', 'content', 'message', '_tokens')
+
+    def __init__(self, name: str, content: str):
+        self.name = name
+        self.content = sys.intern(content)
+        self.message = {"role": "system", "content": self.content}
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = token_counter.count_message(self.content)
+        return self._tokens
+
+PROMPT_VARIANTS = {
+    'default': PromptVariant('default', BASE_SYSTEM_PROMPT),
+    'long': PromptVariant('long', BASE_SYSTEM_PROMPT + LONG_MESSAGE_NOTE)
+}
+
+def select_variant(message: str):
+    return PROMPT_VARIANTS['long' if len(message) > LONG_MESSAGE_CHARS else 'default']
+
+class PromptBuilder:
+    def __init__(self, history_store, counter=token_counter, max_output_chars: int = None):
+        self.history_store = history_store
+        self.counter = counter
+        self.max_output_chars = max_output_chars if max_output_chars is not None else display_limit()
+
+    def prepare(self, variant: PromptVariant, user_message: str, user_id):
+        summary_message, summary_tokens, entries = self.history_store.context(user_id)
+        prompt_tokens = (
+            variant.tokens
+            + summary_tokens
+            + sum(entry.tokens for entry in entries)
+            + self.counter.count_message(user_message)
+            + PROMPT_OVERHEAD_TOKENS
+        )
+
+        skip = 0
+        for entry in entries:
+            if self.counter.completion_budget(prompt_tokens) >= MIN_COMPLETION_TOKENS:
+                break
+            prompt_tokens -= entry.tokens
+            skip += 1
+        # Never ask for more than can be shown; the editor also stops the stream at the same limit.
+        max_tokens = min(
+            max(MIN_COMPLETION_TOKENS, self.counter.completion_budget(prompt_tokens)),
+            max(MIN_COMPLETION_TOKENS, self.counter.output_budget(self.max_output_chars))
+        )
+
+        messages = [variant.message]
+        if summary_message is not None:
+            messages.append(summary_message)
+        messages.extend(entry.message for entry in islice(entries, skip, None))
+        messages.append({"role": "user", "content": user_message})
+        return messages, prompt_tokens, max_tokens
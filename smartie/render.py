@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+
+from smartie.pagination import TRUNCATION_MARK
+
+STREAM_EDIT_MIN_INTERVAL = float(os.getenv('STREAM_EDIT_MIN_INTERVAL', '1.0'))
+STREAM_EDIT_MAX_INTERVAL = float(os.getenv('STREAM_EDIT_MAX_INTERVAL', '5.0'))
+STREAM_EDIT_MIN_CHARS = 50
+
+class EditRateLimited(Exception):
+    def __init__(self, retry_after: float = None):
+        super().__init__(f"rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class ChunkBuffer:
+    __slots__ = ('_chunks', 'length')
+
+    def __init__(self):
+        self._chunks = []
+        self.length = 0
+
+    def append(self, text: str):
+        self._chunks.append(text)
+        self.length += len(text)
+
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks[:] = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def __len__(self):
+        return self.length
+
+def _header_float(headers, name: str):
+    if headers is None:
+        return None
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class EditPacer:
+    def __init__(self, min_interval: float = STREAM_EDIT_MIN_INTERVAL, max_interval: float = STREAM_EDIT_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.latency = None
+
+    def observe(self, latency: float, headers=None):
+        self.latency = latency if self.latency is None else self.latency * 0.7 + latency * 0.3
+        interval = min(self.max_interval, max(self.min_interval, self.latency * 2))
+
+        remaining = _header_float(headers, 'x-ratelimit-remaining')
+        reset_after = _header_float(headers, 'x-ratelimit-reset-after')
+        if remaining is not None and reset_after is not None:
+            if remaining < 1:
+                interval = max(interval, reset_after)
+            else:
+                interval = max(interval, min(self.max_interval, reset_after / remaining))
+        self.interval = interval
+
+    def backoff(self, retry_after: float = None):
+        self.interval = max(min(self.max_interval, self.interval * 2), retry_after or 0)
+
+class StreamingEditor:
+    def __init__(self, edit, pacer: EditPacer = None, min_chars: int = STREAM_EDIT_MIN_CHARS, max_chars: int = None):
+        self.edit = edit
+        self.pacer = pacer or EditPacer()
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.full = False
+        self.buffer = ChunkBuffer()
+        self.edit_count = 0
+        self.failures = 0
+        self._dirty = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def push(self, text: str):
+        if not text or self.full:
+            return
+        if self.max_chars is not None:
+            # Keep room for the mark so the shown text never exceeds max_chars.
+            room = self.max_chars - len(TRUNCATION_MARK) - self.buffer.length
+            if len(text) > room:
+                text = text[:max(room, 0)] + TRUNCATION_MARK
+                self.full = True
+        self.buffer.append(text)
+        if self.buffer.length >= self.min_chars:
+            self._dirty.set()
+
+    def text(self):
+        return self.buffer.text()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            if self._closing.is_set():
+                return
+            self._dirty.clear()
+
+            started = time.monotonic()
+            try:
+                headers = await self.edit(self.buffer.text())
+                self.edit_count += 1
+                self.pacer.observe(time.monotonic() - started, headers)
+            except EditRateLimited as e:
+                self.failures += 1
+                self.pacer.backoff(e.retry_after)
+            except Exception as e:
+                self.failures += 1
+                print(f"Streaming edit failed: {e}")
+                self.pacer.backoff()
+
+            delay = self.pacer.interval - (time.monotonic() - started)
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._closing.wait(), timeout=delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+
+    async def close(self):
+        self._closing.set()
+        self._dirty.set()
+        if self._task is not None:
+            await self._task
+        return self.buffer.text()
+
+    def cancel(self):
+        self._closing.set()
+        if self._task is not None:
+            self._task.cancel()
+        return self.buffer.text()
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import re
+import time
+
+from smartie.prompts import LONG_MESSAGE_CHARS
+from smartie.scheduler import RETRYABLE_STATUS_CODES
+from smartie.tokens import usage_from_chunk
+
+ROUTER_FAST_MODELS = os.getenv('ROUTER_FAST_MODELS', 'llama-3.1-8b-instant')
+ROUTER_STRONG_MODELS = os.getenv('ROUTER_STRONG_MODELS', 'llama-3.3-70b-versatile')
+ROUTER_FAST_MAX_CHARS = int(os.getenv('ROUTER_FAST_MAX_CHARS', '200'))
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.getenv('ROUTER_FIRST_TOKEN_TIMEOUT', '10'))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv('ROUTER_COOLDOWN_SECONDS', '30'))
+ROUTER_HEDGE_AFTER = float(os.getenv('ROUTER_HEDGE_AFTER', '0'))
+ROUTER_HEDGE_BUDGET = float(os.getenv('ROUTER_HEDGE_BUDGET', '0.1'))
+ROUTER_HEDGE_MAX_CREDITS = 10
+
+_COMPLEX_PATTERN = re.compile(
+    r'```|程式|代碼|代码|函式|函數|演算法|算法|證明|推導|計算|分析|比較|解釋|翻譯|步驟|為什麼|为什么|怎麼做|如何|'
+    r'\b(code|debug|explain|analy[sz]e|compare|prove|translate|why|how)\b',
+    re.IGNORECASE
+)
+
+def parse_models(value: str):
+    return [model.strip() for model in value.split(',') if model.strip()]
+
+def is_simple_message(message: str, max_chars: int = ROUTER_FAST_MAX_CHARS):
+    return len(message) <= max_chars and message.count('\n') < 2 and not _COMPLEX_PATTERN.search(message)
+
+class ModelStats:
+    __slots__ = ('ttft', 'tokens_per_second', 'requests', 'failures', 'cooldown_until')
+
+    def __init__(self):
+        self.ttft = None
+        self.tokens_per_second = None
+        self.requests = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def observe(self, ttft: float, tokens_per_second: float = None):
+        self.requests += 1
+        self.ttft = ttft if self.ttft is None else self.ttft * 0.7 + ttft * 0.3
+        if tokens_per_second:
+            if self.tokens_per_second is None:
+                self.tokens_per_second = tokens_per_second
+            else:
+                self.tokens_per_second = self.tokens_per_second * 0.7 + tokens_per_second * 0.3
+
+    def expected_seconds(self, completion_tokens: int):
+        if self.ttft is None:
+            return 0.0
+        if not self.tokens_per_second:
+            return self.ttft
+        return self.ttft + completion_tokens / self.tokens_per_second
+
+    def cooling_down(self, now: float):
+        return self.cooldown_until > now
+
+class RoutedStream:
+    def __init__(self, router, model: str, stream, iterator, first_chunk, started: float):
+        self.router = router
+        self.model = model
+        self.stream = stream
+        self._iterator = iterator
+        self._first_chunk = first_chunk
+        self._started = started
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        if self._first_chunk is None:
+            return
+        first_token_at = time.monotonic()
+        completion_tokens = None
+        chunk = self._first_chunk
+        while True:
+            usage = usage_from_chunk(chunk)
+            if usage is not None:
+                completion_tokens = usage.completion_tokens
+            yield chunk
+            try:
+                chunk = await self._iterator.__anext__()
+            except StopAsyncIteration:
+                break
+        elapsed = time.monotonic() - first_token_at
+        tokens_per_second = completion_tokens / elapsed if completion_tokens and elapsed > 0 else None
+        self.router.observe(self.model, first_token_at - self._started, tokens_per_second)
+
+    async def close(self):
+        await self.stream.close()
+
+class ModelRouter:
+    def __init__(self, fast_models=None, strong_models=None, fast_max_chars: int = ROUTER_FAST_MAX_CHARS,
+                 first_token_timeout: float = ROUTER_FIRST_TOKEN_TIMEOUT, cooldown_seconds: float = ROUTER_COOLDOWN_SECONDS,
+                 hedge_after: float = ROUTER_HEDGE_AFTER, hedge_budget: float = ROUTER_HEDGE_BUDGET,
+                 hedge_max_credits: float = ROUTER_HEDGE_MAX_CREDITS):
+        self.fast_models = fast_models if fast_models is not None else parse_models(ROUTER_FAST_MODELS)
+        self.strong_models = strong_models if strong_models is not None else parse_models(ROUTER_STRONG_MODELS)
+        self.fast_max_chars = fast_max_chars
+        self.first_token_timeout = first_token_timeout
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_after = hedge_after
+        self.hedge_budget = hedge_budget
+        self.hedge_max_credits = hedge_max_credits
+        self.hedge_credits = 1.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self._stats = {}
+
+    def stats_for(self, model: str):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def tier(self, message: str):
+        if self.fast_models and len(message) <= LONG_MESSAGE_CHARS and is_simple_message(message, self.fast_max_chars):
+            return 'fast'
+        return 'strong'
+
+    def _ranked(self, models, completion_tokens: int, now: float):
+        return sorted(models, key=lambda model: (
+            self.stats_for(model).cooling_down(now),
+            self.stats_for(model).expected_seconds(completion_tokens)
+        ))
+
+    def candidates(self, message: str, completion_tokens: int = 0):
+        now = time.monotonic()
+        if self.tier(message) == 'fast':
+            preferred, fallback = self.fast_models, self.strong_models
+        else:
+            preferred, fallback = self.strong_models, self.fast_models
+        ranked = self._ranked(preferred, completion_tokens, now)
+        ranked += [model for model in self._ranked(fallback, completion_tokens, now) if model not in ranked]
+        return ranked
+
+    def observe(self, model: str, ttft: float, tokens_per_second: float = None):
+        self.stats_for(model).observe(ttft, tokens_per_second)
+
+    def mark_failed(self, model: str):
+        stats = self.stats_for(model)
+        stats.failures += 1
+        stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def _take_hedge_credit(self):
+        if self.hedge_after <= 0 or self.hedge_credits < 1:
+            return False
+        self.hedge_credits -= 1
+        self.hedges += 1
+        return True
+
+    async def _attempt(self, scheduler, create, model: str, estimated_tokens: int, max_retries, first_token_timeout):
+        started = time.monotonic()
+        stream = None
+        try:
+            raw_response = await scheduler.call(lambda: create(model), estimated_tokens, max_retries=max_retries)
+            stream = await raw_response.parse()
+            iterator = stream.__aiter__()
+            try:
+                first_chunk = await asyncio.wait_for(iterator.__anext__(), timeout=first_token_timeout)
+            except StopAsyncIteration:
+                first_chunk = None
+        except BaseException:
+            if stream is not None:
+                await stream.close()
+            raise
+        return RoutedStream(self, model, stream, iterator, first_chunk, started)
+
+    async def open_stream(self, scheduler, create, candidates, estimated_tokens: int):
+        from groq import APIConnectionError, APIStatusError
+
+        self.hedge_credits = min(self.hedge_max_credits, self.hedge_credits + self.hedge_budget)
+        remaining = list(candidates)
+        running = {}
+        hedged = False
+        last_error = None
+
+        def launch(model: str, hedge: bool = False):
+            last = not remaining and not hedge
+            task = asyncio.ensure_future(self._attempt(
+                scheduler, create, model, estimated_tokens,
+                max_retries=None if last else 0,
+                first_token_timeout=None if last else self.first_token_timeout
+            ))
+            running[task] = (model, hedge)
+
+        try:
+            while remaining or running:
+                if not running:
+                    launch(remaining.pop(0))
+                timeout = None if hedged or self.hedge_after <= 0 else self.hedge_after
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if self._take_hedge_credit():
+                        launch(remaining.pop(0) if remaining else next(iter(running.values()))[0], hedge=True)
+                    continue
+
+                winner = None
+                for task in done:
+                    model, hedge = running.pop(task)
+                    try:
+                        result = task.result()
+                    except (APIConnectionError, APIStatusError, asyncio.TimeoutError) as e:
+                        if isinstance(e, APIStatusError) and e.status_code not in RETRYABLE_STATUS_CODES:
+                            raise
+                        self.mark_failed(model)
+                        last_error = e
+                        if remaining or running:
+                            self.fallbacks += 1
+                            print(f"Model {model} unavailable, falling back: {e!r}")
+                        continue
+                    if winner is None:
+                        winner = result
+                        if hedge:
+                            self.hedge_wins += 1
+                    else:
+                        await result.close()
+                if winner is not None:
+                    return winner
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    def stats(self):
+        return {
+            model: {
+                'ttft': stats.ttft,
+                'tokens_per_second': stats.tokens_per_second,
+                'requests': stats.requests,
+                'failures': stats.failures
+            }
+            for model, stats in self._stats.items()
+        }
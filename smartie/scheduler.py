@@ -0,0 +1,279 @@
+import asyncio
+import os
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '16'))
+SCHEDULER_MAX_PER_USER = int(os.getenv('SCHEDULER_MAX_PER_USER', '1'))
+SCHEDULER_MAX_RETRIES = int(os.getenv('SCHEDULER_MAX_RETRIES', '3'))
+SCHEDULER_BACKOFF_BASE = float(os.getenv('SCHEDULER_BACKOFF_BASE', '0.5'))
+SCHEDULER_BACKOFF_MAX = float(os.getenv('SCHEDULER_BACKOFF_MAX', '8.0'))
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv('GROQ_REQUESTS_PER_MINUTE', '30'))
+GROQ_TOKENS_PER_MINUTE = float(os.getenv('GROQ_TOKENS_PER_MINUTE', '12000'))
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = _DURATION_PATTERN.findall(str(value))
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+def _header_number(headers, name: str):
+    value = headers.get(name) if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.rate = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def resize(self, capacity: float, refill_per_second: float):
+        self._refill()
+        self.capacity = capacity
+        self.rate = refill_per_second
+        self.tokens = min(self.tokens, capacity)
+
+    def sync(self, remaining: float, reset_after: float = None):
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+        if remaining < 1 and reset_after:
+            self.tokens = min(self.tokens, 1 - reset_after * self.rate)
+
+class Ticket:
+    __slots__ = ('user_id', 'guild_id', 'future', 'on_position', 'position')
+
+    def __init__(self, user_id, guild_id, on_position=None):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.future = None
+        self.on_position = on_position
+        self.position = None
+
+class FairQueue:
+    def __init__(self):
+        self._guilds = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, ticket: Ticket):
+        users = self._guilds.setdefault(ticket.guild_id, OrderedDict())
+        users.setdefault(ticket.user_id, deque()).append(ticket)
+        self._size += 1
+
+    def remove(self, ticket: Ticket):
+        users = self._guilds.get(ticket.guild_id)
+        tickets = users.get(ticket.user_id) if users is not None else None
+        if tickets is None or ticket not in tickets:
+            return False
+        tickets.remove(ticket)
+        self._size -= 1
+        if not tickets:
+            del users[ticket.user_id]
+        if not users:
+            del self._guilds[ticket.guild_id]
+        return True
+
+    def pop_next(self, eligible):
+        for guild_id, users in self._guilds.items():
+            for user_id, tickets in users.items():
+                if not eligible(user_id):
+                    continue
+                ticket = tickets.popleft()
+                self._size -= 1
+                if tickets:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if users:
+                    self._guilds.move_to_end(guild_id)
+                else:
+                    del self._guilds[guild_id]
+                return ticket
+        return None
+
+    def order(self):
+        guilds = deque(
+            deque((user_id, deque(tickets)) for user_id, tickets in users.items())
+            for users in self._guilds.values()
+        )
+        ordered = []
+        while guilds:
+            users = guilds.popleft()
+            user_id, tickets = users.popleft()
+            ordered.append(tickets.popleft())
+            if tickets:
+                users.append((user_id, tickets))
+            if users:
+                guilds.append(users)
+        return ordered
+
+class Scheduler:
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY, max_per_user: int = SCHEDULER_MAX_PER_USER,
+                 requests_per_minute: float = GROQ_REQUESTS_PER_MINUTE, tokens_per_minute: float = GROQ_TOKENS_PER_MINUTE,
+                 max_retries: int = SCHEDULER_MAX_RETRIES, backoff_base: float = SCHEDULER_BACKOFF_BASE,
+                 backoff_max: float = SCHEDULER_BACKOFF_MAX):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.active = 0
+        self.retries = 0
+        self._active_per_user = {}
+        self._queue = FairQueue()
+
+    def _eligible(self, user_id):
+        return self._active_per_user.get(user_id, 0) < self.max_per_user
+
+    def _start(self, ticket: Ticket):
+        self.active += 1
+        self._active_per_user[ticket.user_id] = self._active_per_user.get(ticket.user_id, 0) + 1
+
+    def _release(self, ticket: Ticket):
+        self.active -= 1
+        remaining = self._active_per_user[ticket.user_id] - 1
+        if remaining:
+            self._active_per_user[ticket.user_id] = remaining
+        else:
+            del self._active_per_user[ticket.user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency:
+            ticket = self._queue.pop_next(self._eligible)
+            if ticket is None:
+                break
+            if ticket.future.done():
+                # Cancelled in the same tick, before its waiter could remove it.
+                continue
+            self._start(ticket)
+            ticket.future.set_result(None)
+        self._announce_positions()
+
+    def _announce_positions(self):
+        for index, ticket in enumerate(self._queue.order()):
+            position = index + 1
+            if ticket.on_position is not None and ticket.position != position:
+                ticket.position = position
+                asyncio.ensure_future(ticket.on_position(position))
+
+    @asynccontextmanager
+    async def slot(self, user_id, guild_id=None, on_position=None):
+        ticket = Ticket(user_id, guild_id, on_position)
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._queue.push(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if self._queue.remove(ticket):
+                self._announce_positions()
+            elif not ticket.future.cancelled():
+                self._release(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    async def wait_for_capacity(self, estimated_tokens: int):
+        while True:
+            delay = max(self.request_bucket.delay_for(1), self.token_bucket.delay_for(estimated_tokens))
+            if delay <= 0:
+                self.request_bucket.consume(1)
+                self.token_bucket.consume(estimated_tokens)
+                return
+            await asyncio.sleep(delay)
+
+    def charge_tokens(self, tokens: int):
+        if tokens > 0:
+            self.token_bucket.consume(tokens)
+
+    def observe_headers(self, headers):
+        if headers is None:
+            return
+        token_limit = _header_number(headers, 'x-ratelimit-limit-tokens')
+        if token_limit and token_limit != self.token_bucket.capacity:
+            self.token_bucket.resize(token_limit, token_limit / 60)
+        remaining_tokens = _header_number(headers, 'x-ratelimit-remaining-tokens')
+        if remaining_tokens is not None:
+            self.token_bucket.sync(remaining_tokens, parse_duration(headers.get('x-ratelimit-reset-tokens')))
+        remaining_requests = _header_number(headers, 'x-ratelimit-remaining-requests')
+        if remaining_requests is not None:
+            self.request_bucket.sync(remaining_requests, parse_duration(headers.get('x-ratelimit-reset-requests')))
+
+    def backoff_delay(self, attempt: int, retry_after: float = None):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+        return max(delay, retry_after or 0)
+
+    async def call(self, factory, estimated_tokens: int, max_retries: int = None):
+        from groq import APIConnectionError, APIStatusError
+
+        if max_retries is None:
+            max_retries = self.max_retries
+        attempt = 0
+        while True:
+            await self.wait_for_capacity(estimated_tokens)
+            try:
+                raw = await factory()
+            except (APIConnectionError, APIStatusError) as e:
+                response = getattr(e, 'response', None)
+                headers = response.headers if response is not None else None
+                self.observe_headers(headers)
+                retryable = isinstance(e, APIConnectionError) or e.status_code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt >= max_retries:
+                    raise
+                retry_after = parse_duration(headers.get('retry-after')) if headers is not None else None
+                self.retries += 1
+                await asyncio.sleep(self.backoff_delay(attempt, retry_after))
+                attempt += 1
+                continue
+            self.observe_headers(raw.headers)
+            return raw
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': len(self._queue),
+            'retries': self.retries,
+            'request_tokens': self.request_bucket.tokens,
+            'tpm_tokens': self.token_bucket.tokens
+        }
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from http.server import HTTPServer
+
+from smartie.clients import get_background_loop
+from smartie.metrics import metrics
+
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8080'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '32'))
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '128'))
+SERVER_MAX_GENERATIONS = int(os.getenv('SERVER_MAX_GENERATIONS', '200'))
+SERVER_KEEPALIVE_SECONDS = float(os.getenv('SERVER_KEEPALIVE_SECONDS', '15'))
+SERVER_SHUTDOWN_SECONDS = float(os.getenv('SERVER_SHUTDOWN_SECONDS', '30'))
+
+SERVER_BUSY_BODY = json.dumps({'error': 'Server busy'}).encode()
+SERVER_BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: " + str(len(SERVER_BUSY_BODY)).encode() + b"\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n\r\n" + SERVER_BUSY_BODY
+)
+
+class BackgroundTasks:
+    def __init__(self, max_reserved: int = SERVER_MAX_GENERATIONS):
+        self.max_reserved = max_reserved
+        self.spawned = 0
+        self.rejected = 0
+        self.failed = 0
+        self._reserved = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def reserve(self):
+        with self._lock:
+            if self._reserved >= self.max_reserved:
+                self.rejected += 1
+                return False
+            self._reserved += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._reserved -= 1
+            self._idle.notify_all()
+
+    def spawn(self, coro, reserved: bool = False):
+        future = asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+        with self._lock:
+            self.spawned += 1
+            self._pending.add(future)
+        future.add_done_callback(lambda done: self._finished(done, reserved))
+        return future
+
+    def _finished(self, future, reserved: bool):
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            print(f"Background task failed: {error}")
+        with self._lock:
+            self.failed += error is not None
+            self._pending.discard(future)
+            if reserved:
+                self._reserved -= 1
+            self._idle.notify_all()
+
+    def drain(self, timeout: float):
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending and not self._reserved, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'reserved': self._reserved,
+                'spawned': self.spawned,
+                'rejected': self.rejected,
+                'failed': self.failed
+            }
+
+class KeepAliveHandlerMixin:
+    protocol_version = 'HTTP/1.1'
+    timeout = SERVER_KEEPALIVE_SECONDS
+
+    def end_headers(self):
+        # Give the worker back when others are waiting or we are shutting down.
+        if self.server.draining or self.server.waiting():
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+class PooledHTTPServer(HTTPServer):
+    allow_reuse_address = True
+    request_queue_size = SERVER_BACKLOG
+
+    def __init__(self, server_address, handler_class, workers: int = SERVER_WORKERS, backlog: int = SERVER_BACKLOG):
+        handler_class = type(f"Pooled{handler_class.__name__}", (KeepAliveHandlerMixin, handler_class), {})
+        super().__init__(server_address, handler_class)
+        self.draining = False
+        self.accepted = 0
+        self.rejected = 0
+        self._queue = queue.Queue(maxsize=backlog)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"smartie-http-{index}", daemon=True)
+            for index in range(max(workers, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def waiting(self):
+        return self._queue.qsize()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+            self.accepted += 1
+        except queue.Full:
+            self.rejected += 1
+            try:
+                request.settimeout(1.0)
+                request.sendall(SERVER_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def stop_workers(self, timeout: float):
+        self.draining = True
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        return {
+            'workers': len(self._workers),
+            'waiting': self.waiting(),
+            'accepted': self.accepted,
+            'rejected': self.rejected
+        }
+
+def serve(handler_class, background_tasks: BackgroundTasks, on_shutdown=None,
+          host: str = SERVER_HOST, port: int = SERVER_PORT, shutdown_timeout: float = SERVER_SHUTDOWN_SECONDS):
+    server = PooledHTTPServer((host, port), handler_class)
+    metrics.register_stats('http_server', server.stats)
+    metrics.register_stats('background_tasks', background_tasks.stats)
+    stopping = threading.Event()
+
+    def request_shutdown(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, name='smartie-shutdown', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    print(f"Serving interactions on {host}:{server.server_address[1]} with {len(server._workers)} workers")
+    try:
+        server.serve_forever()
+    finally:
+        print('Shutting down: no longer accepting connections')
+        server.socket.close()
+        server.stop_workers(shutdown_timeout)
+        if not background_tasks.drain(shutdown_timeout):
+            print(f"Shutdown timed out with background tasks still running: {background_tasks.stats()}")
+        if on_shutdown is not None:
+            on_shutdown()
+    return server
@@ -0,0 +1,112 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', '1'))
+SHARD_IDS = os.getenv('SHARD_IDS', '')
+SHARD_CLUSTER = int(os.getenv('SHARD_CLUSTER', '0'))
+SHARD_RESTART_DELAY = float(os.getenv('SHARD_RESTART_DELAY', '5'))
+
+DISCORD_GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+IDENTIFY_INTERVAL_SECONDS = 5.0
+
+def parse_shard_ids(value: str = SHARD_IDS):
+    if not value:
+        return None
+    return [int(shard_id) for shard_id in value.split(',') if shard_id.strip()]
+
+def is_cluster_child():
+    return parse_shard_ids() is not None
+
+def process_count(processes: int = SHARD_PROCESSES):
+    return processes if processes > 0 else (os.cpu_count() or 1)
+
+def is_sharded():
+    return SHARD_COUNT > 0 or process_count() > 1 or is_cluster_child()
+
+def fetch_gateway_info(token: str):
+    request = urllib.request.Request(DISCORD_GATEWAY_URL, headers={
+        'Authorization': f"Bot {token}",
+        'User-Agent': 'DiscordBot (https://github.com/Kevin42127/Smartie, 1.0)'
+    })
+    with urllib.request.urlopen(request, timeout=10) as response:
+        payload = json.load(response)
+    return payload.get('shards', 1), payload.get('session_start_limit', {}).get('max_concurrency', 1)
+
+def plan_clusters(shard_count: int, processes: int):
+    processes = max(1, min(processes, shard_count))
+    return [list(range(cluster, shard_count, processes)) for cluster in range(processes)]
+
+class ClusterLauncher:
+    def __init__(self, script: str, shard_count: int, processes: int, max_concurrency: int = 1,
+                 restart_delay: float = SHARD_RESTART_DELAY):
+        self.script = script
+        self.shard_count = shard_count
+        self.clusters = plan_clusters(shard_count, processes)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.restart_delay = restart_delay
+        self.children = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def _environment(self, cluster: int):
+        environment = dict(os.environ)
+        environment['SHARD_COUNT'] = str(self.shard_count)
+        environment['SHARD_IDS'] = ','.join(str(shard_id) for shard_id in self.clusters[cluster])
+        environment['SHARD_CLUSTER'] = str(cluster)
+        environment.setdefault('HISTORY_BACKEND', 'sqlite')
+        return environment
+
+    def _start(self, cluster: int):
+        shard_ids = self.clusters[cluster]
+        print(f"啟動叢集 {cluster}：分片 {shard_ids}（共 {self.shard_count} 個分片）")
+        self.children[cluster] = subprocess.Popen([sys.executable, self.script], env=self._environment(cluster))
+
+    def _stagger(self, cluster: int):
+        # Discord only allows max_concurrency IDENTIFYs per 5 seconds across the whole bot.
+        return len(self.clusters[cluster]) / self.max_concurrency * IDENTIFY_INTERVAL_SECONDS
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for child in self.children.values():
+            if child.poll() is None:
+                child.send_signal(signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for cluster in range(len(self.clusters)):
+            if self.stopping:
+                break
+            self._start(cluster)
+            if cluster + 1 < len(self.clusters):
+                time.sleep(self._stagger(cluster))
+
+        while self.children:
+            for cluster, child in list(self.children.items()):
+                code = child.poll()
+                if code is None:
+                    continue
+                del self.children[cluster]
+                if self.stopping:
+                    continue
+                print(f"叢集 {cluster} 已結束（代碼 {code}），{self.restart_delay:.0f} 秒後重新啟動")
+                time.sleep(self.restart_delay)
+                self.restarts += 1
+                self._start(cluster)
+            time.sleep(1)
+        return 0
+
+def launch(script: str, token: str):
+    history_backend = os.getenv('HISTORY_BACKEND', '').lower()
+    if history_backend == 'memory':
+        raise ValueError("多程序分片需要共用的對話記憶，請將 HISTORY_BACKEND 設為 sqlite")
+    shard_count, max_concurrency = SHARD_COUNT, 1
+    if shard_count <= 0:
+        shard_count, max_concurrency = fetch_gateway_info(token)
+    return ClusterLauncher(script, shard_count, process_count(), max_concurrency).run()
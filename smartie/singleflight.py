@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+
+from smartie.cache import normalize_message
+
+def flight_key(model: str, system_prompt: str, message: str, max_tokens: int):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, system_prompt, normalize_message(message), str(max_tokens)):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class Flight:
+    __slots__ = ('key', 'model', 'chunks', 'finished', 'error', 'subscribers', 'task', '_updated')
+
+    def __init__(self, key):
+        self.key = key
+        self.model = None
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.finished = True
+        self.error = error
+        self._notify()
+
+class FlightSubscription:
+    def __init__(self, single_flight, flight: Flight, leader: bool):
+        self.single_flight = single_flight
+        self.flight = flight
+        self.leader = leader
+        self.closed = False
+
+    @property
+    def model(self):
+        return self.flight.model
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        flight = self.flight
+        index = 0
+        while True:
+            if index < len(flight.chunks):
+                yield flight.chunks[index]
+                index += 1
+                continue
+            if flight.finished:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await flight._updated.wait()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.single_flight._unsubscribe(self.flight)
+
+class SingleFlight:
+    def __init__(self):
+        self.flights = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    def subscribe(self, key, factory):
+        flight = self._inflight.get(key) if key is not None else None
+        leader = flight is None
+        if leader:
+            flight = Flight(key)
+            flight.task = asyncio.ensure_future(self._run(flight, factory))
+            if key is not None:
+                self._inflight[key] = flight
+            self.flights += 1
+        else:
+            self.coalesced += 1
+        flight.subscribers += 1
+        return FlightSubscription(self, flight, leader)
+
+    def _forget(self, flight: Flight):
+        if flight.key is not None and self._inflight.get(flight.key) is flight:
+            del self._inflight[flight.key]
+
+    def _unsubscribe(self, flight: Flight):
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.finished:
+            self._forget(flight)
+            flight.task.cancel()
+
+    async def _run(self, flight: Flight, factory):
+        stream = None
+        error = None
+        try:
+            stream = await factory()
+            flight.model = getattr(stream, 'model', None)
+            async for chunk in stream:
+                flight.publish(chunk)
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+        except Exception as e:
+            error = e
+        finally:
+            self._forget(flight)
+            flight.finish(error)
+            if stream is not None:
+                await stream.close()
+
+    def stats(self):
+        return {
+            'inflight': len(self._inflight),
+            'flights': self.flights,
+            'coalesced': self.coalesced
+        }
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+from smartie.clients import get_async_groq_client
+from smartie.scheduler import Scheduler
+from smartie.tokens import token_counter
+from smartie.zhconvert import to_traditional
+
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', '1') == '1'
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'llama-3.1-8b-instant')
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv('SUMMARY_MAX_CONCURRENCY', '4'))
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你負責維護一段對話的長期記憶摘要。請把「既有摘要」與「新移出的對話」合併成一份新的摘要，"
+    "保留用戶的身分、偏好、正在討論的主題、已做出的結論與尚未解決的問題，省略寒暄與重複內容。"
+    f"請使用繁體中文，以條列或短段落呈現，總長度不超過 {SUMMARY_MAX_TOKENS // 2} 字，只輸出摘要本身。"
+)
+
+ROLE_LABELS = {'user': '用戶', 'assistant': '小智'}
+
+def format_transcript(entries):
+    return "\n".join(f"{ROLE_LABELS.get(entry.role, entry.role)}：{entry.content}" for entry in entries)
+
+class Summarizer:
+    def __init__(self, history_store, api_key: str = None, model: str = SUMMARY_MODEL,
+                 max_tokens: int = SUMMARY_MAX_TOKENS, enabled: bool = SUMMARY_ENABLED, scheduler: Scheduler = None):
+        self.history_store = history_store
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.enabled = enabled
+        self.scheduler = scheduler or Scheduler(max_concurrency=SUMMARY_MAX_CONCURRENCY, max_per_user=1)
+        self.compactions = 0
+        self.failures = 0
+        self._tasks = set()
+
+    def build_messages(self, summary: str, evicted):
+        content = f"既有摘要：\n{summary or '（無）'}\n\n新移出的對話：\n{format_transcript(evicted)}"
+        return [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ]
+
+    async def compact(self, user_id, evicted, conversation_id: str = None):
+        if not self.enabled or not evicted:
+            return False
+        try:
+            async with self.scheduler.slot(user_id):
+                if conversation_id is not None and self.history_store.conversation_id(user_id) != conversation_id:
+                    return False
+                messages = self.build_messages(self.history_store.summary(user_id), evicted)
+                prompt_tokens = sum(token_counter.count_message(message['content']) for message in messages)
+                raw_response = await self.scheduler.call(
+                    lambda: get_async_groq_client(self.api_key).chat.completions.with_raw_response.create(
+                        messages=messages,
+                        model=self.model,
+                        temperature=0.2,
+                        max_tokens=self.max_tokens
+                    ),
+                    prompt_tokens + self.max_tokens
+                )
+                completion = await raw_response.parse()
+                summary = to_traditional((completion.choices[0].message.content or '').strip())
+                if not summary:
+                    return False
+                self.compactions += 1
+                return self.history_store.set_summary(user_id, summary, conversation_id)
+        except Exception as e:
+            self.failures += 1
+            print(f"History summarization failed: {e}")
+            return False
+
+    def schedule(self, user_id, evicted, conversation_id: str = None):
+        if not self.enabled or not evicted:
+            return None
+        task = asyncio.ensure_future(self.compact(user_id, evicted, conversation_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
@@ -0,0 +1,110 @@
+import math
+import os
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+
+CONTEXT_WINDOW = 4096
+MAX_COMPLETION_TOKENS = 2048
+MIN_COMPLETION_TOKENS = 256
+COMPLETION_SAFETY_MARGIN = 64
+MESSAGE_OVERHEAD_TOKENS = 4
+PROMPT_OVERHEAD_TOKENS = 3
+# CJK text costs about one token per character, the most any answer should need.
+MIN_OUTPUT_TOKENS_PER_CHAR = 1.0
+OUTPUT_RATIO_WINDOW = 50
+MIN_OUTPUT_SAMPLE_CHARS = 50
+
+# Groq bills with the served models' own tokenizers, which are not shipped here; counts
+# are a CJK-aware estimate calibrated against reported usage. A tiktoken encoding can be
+# opted into, but it is still an approximation and downloads its vocabulary on first use.
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', '')
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '4096'))
+
+_CJK_RANGES = '\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u312f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef'
+_CJK_PATTERN = re.compile(f'[{_CJK_RANGES}]')
+_WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+_SYMBOL_PATTERN = re.compile(f'[^\\sA-Za-z0-9{_CJK_RANGES}]')
+
+def estimate_tokens(text: str):
+    cjk_tokens = len(_CJK_PATTERN.findall(text))
+    word_tokens = sum(math.ceil(len(word) / 4) for word in _WORD_PATTERN.findall(text))
+    symbol_tokens = len(_SYMBOL_PATTERN.findall(text))
+    return cjk_tokens + word_tokens + symbol_tokens
+
+class TokenCounter:
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING, cache_size: int = TOKEN_CACHE_SIZE):
+        self.encoding_name = encoding_name
+        self.scale = 1.0
+        self.calibration_samples = 0
+        self.output_ratios = deque(maxlen=OUTPUT_RATIO_WINDOW)
+        self._encoding = None
+        self._encoding_loaded = not encoding_name
+        self._lock = threading.Lock()
+        self._count_cached = lru_cache(maxsize=cache_size)(self._count_raw)
+    
+    def _get_encoding(self):
+        if not self._encoding_loaded:
+            with self._lock:
+                if not self._encoding_loaded:
+                    try:
+                        import tiktoken
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        print(f"Tokenizer unavailable, falling back to estimate: {e}")
+                        self._encoding = None
+                    self._encoding_loaded = True
+        return self._encoding
+    
+    def _count_raw(self, text: str):
+        encoding = self._get_encoding()
+        if encoding is None:
+            return estimate_tokens(text)
+        return len(encoding.encode(text, disallowed_special=()))
+    
+    def count_text(self, text: str):
+        if not text:
+            return 0
+        return self._count_cached(text)
+    
+    def count_message(self, content: str):
+        return self.count_text(content) + MESSAGE_OVERHEAD_TOKENS
+    
+    def scaled(self, tokens: int):
+        return math.ceil(tokens * self.scale)
+    
+    def calibrate(self, estimated_tokens: int, actual_tokens: int):
+        if estimated_tokens <= 0 or not actual_tokens:
+            return
+        ratio = min(3.0, max(0.5, actual_tokens / estimated_tokens))
+        with self._lock:
+            if self.calibration_samples == 0:
+                self.scale = ratio
+            else:
+                self.scale = self.scale * 0.8 + ratio * 0.2
+            self.calibration_samples += 1
+    
+    def completion_budget(self, prompt_tokens: int):
+        available = CONTEXT_WINDOW - self.scaled(prompt_tokens) - COMPLETION_SAFETY_MARGIN
+        return min(MAX_COMPLETION_TOKENS, available)
+    
+    def observe_output(self, chars: int, completion_tokens: int):
+        if chars < MIN_OUTPUT_SAMPLE_CHARS or not completion_tokens:
+            return
+        with self._lock:
+            self.output_ratios.append(min(3.0, completion_tokens / chars))
+    
+    def output_budget(self, chars: int):
+        # Budget for the costliest recent answer, never below the CJK worst case,
+        # so the cap cannot end an answer before the editor's display limit does.
+        with self._lock:
+            ratio = max(self.output_ratios, default=MIN_OUTPUT_TOKENS_PER_CHAR)
+        return math.ceil(chars * max(ratio, MIN_OUTPUT_TOKENS_PER_CHAR))
+
+def usage_from_chunk(chunk):
+    x_groq = getattr(chunk, 'x_groq', None)
+    usage = getattr(x_groq, 'usage', None) if x_groq is not None else None
+    return usage or getattr(chunk, 'usage', None)
+
+token_counter = TokenCounter()
@@ -0,0 +1,113 @@
+import os
+import re
+import threading
+
+SCRIPT_CONVERSION_ENABLED = os.getenv('SCRIPT_CONVERSION_ENABLED', '1') == '1'
+SCRIPT_CONVERSION_DICTS = os.getenv('SCRIPT_CONVERSION_DICTS', '')
+
+DEFAULT_DICT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 's2tw.txt')
+
+def load_table(paths):
+    table = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as source:
+            for line in source:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                # OpenCC dictionaries list alternatives after the first target; keep the first.
+                source_text, _, targets = line.rstrip('\n').partition('\t')
+                target = targets.split(' ')[0]
+                if source_text and target:
+                    table[source_text] = target
+    return table
+
+class ScriptConverter:
+    def __init__(self, table: dict):
+        self.table = table
+        self.max_length = max(map(len, table), default=1)
+        # Every proper prefix of a phrase: a streamed tail matching one may still grow.
+        self.prefixes = {phrase[:size] for phrase in table for size in range(1, len(phrase))}
+        initials = sorted({phrase[0] for phrase in table})
+        self._initials = re.compile('[' + ''.join(re.escape(initial) for initial in initials) + ']') if initials else None
+
+    def _translate(self, text: str, final: bool):
+        if self._initials is None:
+            return text, ''
+        table = self.table
+        search = self._initials.search
+        length = len(text)
+        pieces = []
+        start = index = 0
+        while True:
+            match = search(text, index)
+            if match is None:
+                break
+            index = match.start()
+            remaining = length - index
+            if not final and remaining < self.max_length and text[index:] in self.prefixes:
+                pieces.append(text[start:index])
+                return ''.join(pieces), text[index:]
+            for size in range(min(self.max_length, remaining), 0, -1):
+                replacement = table.get(text[index:index + size])
+                if replacement is not None:
+                    pieces.append(text[start:index])
+                    pieces.append(replacement)
+                    index += size
+                    start = index
+                    break
+            else:
+                index += 1
+        pieces.append(text[start:])
+        return ''.join(pieces), ''
+
+    def convert(self, text: str):
+        return self._translate(text, final=True)[0]
+
+    def stream(self):
+        return StreamConversion(self)
+
+class StreamConversion:
+    __slots__ = ('converter', 'pending')
+
+    def __init__(self, converter: ScriptConverter):
+        self.converter = converter
+        self.pending = ''
+
+    def feed(self, text: str):
+        converted, self.pending = self.converter._translate(self.pending + text, final=False)
+        return converted
+
+    def flush(self):
+        converted, self.pending = self.converter.convert(self.pending), ''
+        return converted
+
+class PassthroughStream:
+    __slots__ = ()
+
+    def feed(self, text: str):
+        return text
+
+    def flush(self):
+        return ''
+
+_converter = None
+_converter_lock = threading.Lock()
+
+def get_converter():
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                extra_paths = [path.strip() for path in SCRIPT_CONVERSION_DICTS.split(',') if path.strip()]
+                _converter = ScriptConverter(load_table([DEFAULT_DICT_PATH] + extra_paths))
+    return _converter
+
+def to_traditional(text: str):
+    if not SCRIPT_CONVERSION_ENABLED or not text:
+        return text
+    return get_converter().convert(text)
+
+def traditional_stream():
+    if not SCRIPT_CONVERSION_ENABLED:
+        return PassthroughStream()
+    return get_converter().stream()
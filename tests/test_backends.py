@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smartie import backends
+from smartie.backends import SQLiteHistoryBackend
+
+def test_connection_opened_on_first_use(tmp_path):
+    path = tmp_path / 'history.sqlite3'
+    backend = SQLiteHistoryBackend(str(path), flush_interval=0)
+    assert not path.exists()
+    assert backend.load('user') is None
+    assert path.exists()
+    backend.close()
+
+def test_pending_snapshot_visible_while_flushing(tmp_path, monkeypatch):
+    backend = SQLiteHistoryBackend(str(tmp_path / 'history.sqlite3'), flush_interval=0)
+    backend.save('user', {'messages': [['user', 'one']]})
+    backend.flush()
+    latest = {'messages': [['user', 'one'], ['user', 'two']]}
+    backend.save('user', latest)
+
+    encoding = threading.Event()
+    release = threading.Event()
+    dumps = backends.json.dumps
+
+    def slow_dumps(*args, **kwargs):
+        encoding.set()
+        release.wait(5)
+        return dumps(*args, **kwargs)
+
+    monkeypatch.setattr(backends.json, 'dumps', slow_dumps)
+    flusher = threading.Thread(target=backend.flush)
+    flusher.start()
+    encoding.wait(5)
+    try:
+        assert backend.load('user') == latest
+    finally:
+        release.set()
+        flusher.join()
+    assert backend.load('user') == latest
+    backend.close()
+
+def test_flush_purges_expired_rows(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    backend = SQLiteHistoryBackend(path, flush_interval=0, ttl_seconds=60)
+    backend.save('active', {'messages': []})
+    backend.flush()
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO conversations VALUES ('stale', '{}', ?)", (time.time() - 3600,))
+
+    backend._purged_at = None
+    backend.save('active', {'messages': [['user', 'hi']]})
+    backend.flush()
+    with sqlite3.connect(path) as connection:
+        users = [row[0] for row in connection.execute('SELECT user_id FROM conversations')]
+    assert users == ['active']
+    assert backend.purged == 1
+    backend.close()
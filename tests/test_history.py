@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smartie.backends import SQLiteHistoryBackend
+from smartie.history import HistoryStore
+
+def _clear_then_summarize(store):
+    store.append('user', 'user', '我叫 Bob')
+    conversation_id = store.conversation_id('user')
+    store.clear('user')
+    store.append('user', 'user', '你好')
+    # A compaction of the cleared conversation finishes after the new message.
+    assert not store.set_summary('user', '用戶名叫 Bob', conversation_id)
+    assert store.summary('user') == ''
+    assert store.set_summary('user', '用戶打了招呼', store.conversation_id('user'))
+    assert store.summary('user') == '用戶打了招呼'
+
+def test_late_summary_ignored_after_clear():
+    _clear_then_summarize(HistoryStore(10, 2000))
+
+def test_late_summary_ignored_after_clear_with_shared_backend(tmp_path):
+    backend = SQLiteHistoryBackend(str(tmp_path / 'history.sqlite3'), flush_interval=0, batch_size=1)
+    try:
+        _clear_then_summarize(HistoryStore(10, 2000, backend=backend, cache_seconds=0))
+    finally:
+        backend.close()
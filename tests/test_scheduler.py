@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smartie.scheduler import Scheduler
+
+def test_waiter_cancelled_while_slot_is_released():
+    async def scenario():
+        scheduler = Scheduler(max_concurrency=1, max_per_user=1)
+        release = asyncio.Event()
+        entered = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot('holder'):
+                entered.set()
+                await release.wait()
+            return 'answer'
+
+        async def waiter():
+            async with scheduler.slot('waiter'):
+                pass
+
+        holding = asyncio.create_task(holder())
+        await entered.wait()
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+
+        # Both happen in the same tick: the waiter's future is cancelled while
+        # its ticket is still queued, then the holder's release dispatches it.
+        release.set()
+        waiting.cancel()
+
+        assert await holding == 'answer'
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.stats()['active'] == 0
+        assert scheduler.stats()['queued'] == 0
+
+        async with scheduler.slot('after'):
+            assert scheduler.stats()['active'] == 1
+
+    asyncio.run(scenario())